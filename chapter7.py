@@ -268,10 +268,11 @@ Classifying with Multiple Binary Classifiers
 >>> len(reuters.categories())
 90
 
->>> from featx import reuters_high_info_words, reuters_train_test_feats
->>> rwords = reuters_high_info_words()
+>>> from featx import reuters_fileid_words, reuters_high_info_words, reuters_train_test_feats
+>>> fileid_words = reuters_fileid_words()
+>>> rwords = reuters_high_info_words(fileid_words=fileid_words)
 >>> featdet = lambda words: bag_of_words_in_set(words, rwords)
->>> multi_train_feats, multi_test_feats = reuters_train_test_feats(featdet)
+>>> multi_train_feats, multi_test_feats = reuters_train_test_feats(featdet, fileid_words=fileid_words)
 
 >>> from classification import train_binary_classifiers
 >>> trainf = lambda train_feats: SklearnClassifier(LogisticRegression()).train(train_feats)
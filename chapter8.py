@@ -101,10 +101,9 @@ Distributed Word Scoring with Redis and Execnet
 >>> topn_words = word_scores.keys(end=1000)
 >>> topn_words[0:5]
 [b'bad', b',', b'and', b'?', b'movie']
->>> from redis import Redis
->>> r = Redis()
->>> [r.delete(key) for key in ['word_fd', 'label_word_fd:neg', 'label_word_fd:pos', 'word_scores']]
-[1, 1, 1, 1]
+>>> from dist_featx import clear_score_words
+>>> clear_score_words()
+6
 '''
 
 if __name__ == '__main__':
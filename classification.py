@@ -1,56 +1,542 @@
-import collections, itertools
+import collections, itertools, math, multiprocessing, numpy, os, pickle, time
+from collections.abc import Iterable, Mapping
 from nltk import metrics
 from nltk.classify import util, ClassifierI, MultiClassifierI
 from nltk.probability import FreqDist
+from scipy import sparse
 
-def precision_recall(classifier, testfeats):
-	refsets = collections.defaultdict(set)
-	testsets = collections.defaultdict(set)
-	
-	for i, (feats, label) in enumerate(testfeats):
-		refsets[label].add(i)
-		observed = classifier.classify(feats)
-		testsets[observed].add(i)
+def _classify_chunk(args):
+	classifier, featuresets = args
+	return classify_many(classifier, featuresets)
+
+def classify_many(classifier, featuresets, processes=None, pool=None):
+	'''
+	Classifies all the featuresets with one classify_many call when the
+	classifier has it. If processes is given, the featuresets are split into
+	that many chunks and classified in a multiprocessing pool. Pass a pool
+	of processes workers to reuse it over many calls, instead of starting a
+	new one for each.
+	'''
+	featuresets = list(featuresets)
 	
+	if processes and processes > 1 and len(featuresets) > 1:
+		size = int(math.ceil(len(featuresets) / float(processes)))
+		chunks = [(classifier, featuresets[i:i + size]) for i in range(0, len(featuresets), size)]
+		
+		if pool:
+			return list(itertools.chain(*pool.map(_classify_chunk, chunks)))
+		
+		pool = multiprocessing.Pool(processes)
+		
+		try:
+			results = pool.map(_classify_chunk, chunks)
+		finally:
+			pool.close()
+			pool.join()
+		
+		return list(itertools.chain(*results))
+	elif hasattr(classifier, 'classify_many'):
+		return list(classifier.classify_many(featuresets))
+	else:
+		return [classifier.classify(feats) for feats in featuresets]
+
+def _precisions_recalls(labels, true_pos, ref_counts, test_counts):
+	# same results as metrics.precision & metrics.recall on sets of indices
 	precisions = {}
 	recalls = {}
 	
-	for label in classifier.labels():
-		precisions[label] = metrics.precision(refsets[label], testsets[label])
-		recalls[label] = metrics.recall(refsets[label], testsets[label])
+	for i, label in enumerate(labels):
+		precisions[label] = float(true_pos[i]) / int(test_counts[i]) if test_counts[i] else None
+		recalls[label] = float(true_pos[i]) / int(ref_counts[i]) if ref_counts[i] else None
 	
 	return precisions, recalls
 
+def precision_recall(classifier, testfeats, processes=None):
+	labels = classifier.labels()
+	index = dict([(label, i) for i, label in enumerate(labels)])
+	testfeats = list(testfeats)
+	observed = classify_many(classifier, [feats for feats, label in testfeats], processes=processes)
+	# labels the classifier doesn't know become -1, and are not counted
+	refs = numpy.array([index.get(label, -1) for feats, label in testfeats], dtype=numpy.intp)
+	tests = numpy.array([index.get(label, -1) for label in observed], dtype=numpy.intp)
+	n = len(labels)
+	ref_counts = numpy.bincount(refs[refs >= 0], minlength=n)
+	test_counts = numpy.bincount(tests[tests >= 0], minlength=n)
+	true_pos = numpy.bincount(refs[(refs == tests) & (refs >= 0)], minlength=n)
+	return _precisions_recalls(labels, true_pos, ref_counts, test_counts)
+
+def _fmeasure(precision, recall):
+	# same as metrics.f_measure with alpha=0.5
+	if precision is None or recall is None:
+		return None
+	elif precision == 0 or recall == 0:
+		return 0
+	else:
+		return 2.0 * precision * recall / (precision + recall)
+
+def _average(scores):
+	scores = [score for score in scores if score is not None]
+	return sum(scores) / float(len(scores)) if scores else None
+
+def evaluate(classifier, test_feats, batch_size=1000, processes=None):
+	'''
+	Evaluates a classifier in one pass over test_feats, which can be any
+	iterable of (feats, label), including a generator, since only batch_size
+	examples are kept in memory at a time. With processes, every batch is
+	classified in one multiprocessing pool, started once for the whole run.
+	Returns a dict with:
+	
+	* accuracy
+	* precisions, recalls and fmeasures: dicts of label to score
+	* micro and macro: dicts of precision, recall and fmeasure averages
+	* masi: the average masi distance between reference and observed labels
+	* labels and confusion: a numpy array of counts, with a row for each
+	  reference label and a column for each observed label
+	* n, seconds, examples_per_second and seconds_per_example, where seconds
+	  is the time spent classifying
+	
+	>>> from nltk.classify import NaiveBayesClassifier
+	>>> train_feats = [({'a': True}, 'pos'), ({'b': True}, 'neg')]
+	>>> classifier = NaiveBayesClassifier.train(train_feats)
+	>>> test_feats = (feats for feats in train_feats + [({'a': True}, 'neg')])
+	>>> report = evaluate(classifier, test_feats, batch_size=2)
+	>>> report['n'], report['accuracy']
+	(3, 0.6666666666666666)
+	>>> sorted(report['labels'])
+	['neg', 'pos']
+	>>> i, j = report['labels'].index('neg'), report['labels'].index('pos')
+	>>> int(report['confusion'][i, i]), int(report['confusion'][i, j])
+	(1, 1)
+	>>> report['precisions']['pos'], report['recalls']['neg']
+	(0.5, 0.5)
+	>>> report['fmeasures']['pos'], report['macro']['fmeasure']
+	(0.6666666666666666, 0.6666666666666666)
+	
+	Multi label classifiers, like MultiBinaryClassifier, are evaluated the
+	same way as multi_metrics, with labels that are sets, or lists, of
+	labels. Then accuracy counts exact matches, micro averages are over all
+	the (example, label) pairs, and confusion is None.
+	
+	>>> class Classifier(object):
+	...     def labels(self): return ['a', 'b']
+	...     def classify(self, feats): return set(feats)
+	>>> report = evaluate(Classifier(), [(['a'], ['a', 'b']), (['b'], ['b'])])
+	>>> report['accuracy'], report['recalls']['b'], report['micro']['recall']
+	(0.5, 0.5, 0.6666666666666666)
+	>>> 0 < report['masi'] < 0.5
+	True
+	>>> report['confusion'] is None
+	True
+	'''
+	multi = None
+	# (reference, observed) counts for single label classifiers
+	pairs = collections.Counter()
+	# per label counts, exact matches and total masi distance for multi
+	# label classifiers
+	ref_counts = collections.Counter()
+	test_counts = collections.Counter()
+	true_counts = collections.Counter()
+	exact = 0
+	masi = 0.0
+	n = 0
+	seconds = 0.0
+	test_feats = iter(test_feats)
+	batch = list(itertools.islice(test_feats, batch_size))
+	pool = multiprocessing.Pool(processes) if processes and processes > 1 and batch else None
+	
+	try:
+		while batch:
+			start = time.time()
+			observed = classify_many(classifier, [feats for feats, label in batch], processes=processes, pool=pool)
+			seconds += time.time() - start
+			refs = [label for feats, label in batch]
+			
+			if multi is None:
+				multi = isinstance(refs[0], (set, frozenset, list))
+			
+			if multi:
+				for ref, test in zip(refs, observed):
+					ref, test = set(ref), set(test)
+					ref_counts.update(ref)
+					test_counts.update(test)
+					true_counts.update(ref & test)
+					exact += ref == test
+					masi += metrics.masi_distance(ref, test)
+			else:
+				pairs.update(zip(refs, observed))
+			
+			n += len(batch)
+			batch = list(itertools.islice(test_feats, batch_size))
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+	
+	labels = list(classifier.labels())
+	seen = list(ref_counts) + list(test_counts) if multi else itertools.chain(*pairs)
+	
+	for label in seen:
+		if label not in labels:
+			labels.append(label)
+	
+	if multi:
+		confusion = None
+		true_pos = numpy.array([true_counts[label] for label in labels], dtype=numpy.int64)
+		refs = numpy.array([ref_counts[label] for label in labels], dtype=numpy.int64)
+		tests = numpy.array([test_counts[label] for label in labels], dtype=numpy.int64)
+		accuracy = float(exact) / n if n else None
+		micro_precision = float(true_pos.sum()) / int(tests.sum()) if tests.sum() else None
+		micro_recall = float(true_pos.sum()) / int(refs.sum()) if refs.sum() else None
+	else:
+		index = dict([(label, i) for i, label in enumerate(labels)])
+		confusion = numpy.zeros((len(labels), len(labels)), dtype=numpy.int64)
+		
+		for (ref, test), count in pairs.items():
+			confusion[index[ref], index[test]] = count
+		
+		true_pos = confusion.diagonal()
+		refs = confusion.sum(axis=1)
+		tests = confusion.sum(axis=0)
+		accuracy = float(true_pos.sum()) / n if n else None
+		# every example has one reference and one observed label, so micro
+		# averaged precision and recall are both the accuracy, and the masi
+		# distance of an example is 0 when it's right and 1 when it's wrong
+		micro_precision = micro_recall = accuracy
+		masi = int(n - true_pos.sum())
+	
+	precisions, recalls = _precisions_recalls(labels, true_pos, refs, tests)
+	fmeasures = dict([(label, _fmeasure(precisions[label], recalls[label])) for label in labels])
+	
+	return {
+		'n': n,
+		'accuracy': accuracy,
+		'precisions': precisions,
+		'recalls': recalls,
+		'fmeasures': fmeasures,
+		'micro': {
+			'precision': micro_precision,
+			'recall': micro_recall,
+			'fmeasure': _fmeasure(micro_precision, micro_recall)
+		},
+		'macro': {
+			'precision': _average(precisions.values()),
+			'recall': _average(recalls.values()),
+			'fmeasure': _average(fmeasures.values())
+		},
+		'masi': float(masi) / n if n else None,
+		'labels': labels,
+		'confusion': confusion,
+		'seconds': seconds,
+		'examples_per_second': n / seconds if seconds else None,
+		'seconds_per_example': seconds / n if n else None
+	}
+
 class MaxVoteClassifier(ClassifierI):
-	def __init__(self, *classifiers):
+	'''
+	Chooses the label with the most votes from its classifiers. If executor
+	is a concurrent.futures executor, the classifiers vote in parallel, each
+	classifying a whole batch at once. With short_circuit, voting stops as
+	soon as a label has more votes than any other label could still get,
+	so put the fastest classifiers first. Parallel voting always waits for
+	every classifier, so executor and short_circuit can't be used together.
+	
+	>>> from nltk.classify import NaiveBayesClassifier
+	>>> train_feats = [({'a': True}, 'pos'), ({'b': True}, 'neg')]
+	>>> classifier = NaiveBayesClassifier.train(train_feats)
+	>>> mv_classifier = MaxVoteClassifier(classifier, classifier, classifier, short_circuit=True)
+	>>> mv_classifier.classify_many([{'a': True}, {'b': True}])
+	['pos', 'neg']
+	>>> MaxVoteClassifier(classifier, executor=object(), short_circuit=True)
+	Traceback (most recent call last):
+	ValueError: short_circuit can't be used with an executor
+	'''
+	def __init__(self, *classifiers, executor=None, short_circuit=False):
+		if executor and short_circuit:
+			raise ValueError("short_circuit can't be used with an executor")
+		
 		self._classifiers = classifiers
 		self._labels = sorted(set(itertools.chain(*[c.labels() for c in classifiers])))
+		self._executor = executor
+		self._short_circuit = short_circuit
 	
 	def labels(self):
 		return self._labels
 	
+	def _decided(self, counts, remaining):
+		top = counts.most_common(2)
+		second = top[1][1] if len(top) > 1 else 0
+		return top[0][1] > second + remaining
+	
 	def classify(self, feats):
+		if self._executor:
+			return self.classify_many([feats])[0]
+		
 		counts = FreqDist()
 		
-		for classifier in self._classifiers:
+		for i, classifier in enumerate(self._classifiers):
 			counts[classifier.classify(feats)] += 1
+			
+			if self._short_circuit and self._decided(counts, len(self._classifiers) - i - 1):
+				break
 		
 		return counts.max()
+	
+	def classify_many(self, featuresets):
+		featuresets = list(featuresets)
+		counts = [FreqDist() for feats in featuresets]
+		
+		if self._executor:
+			futures = [self._executor.submit(classify_many, c, featuresets) for c in self._classifiers]
+			
+			for future in futures:
+				for fd, label in zip(counts, future.result()):
+					fd[label] += 1
+		else:
+			# indexes of the featuresets that still need votes
+			undecided = list(range(len(featuresets)))
+			
+			for i, classifier in enumerate(self._classifiers):
+				observed = classify_many(classifier, [featuresets[j] for j in undecided])
+				
+				for j, label in zip(undecided, observed):
+					counts[j][label] += 1
+				
+				if self._short_circuit:
+					remaining = len(self._classifiers) - i - 1
+					undecided = [j for j in undecided if not self._decided(counts[j], remaining)]
+		
+		return [fd.max() for fd in counts]
+
+def is_linear_sklearn(classifier):
+	'''
+	Returns True if classifier is a SklearnClassifier wrapping a fitted
+	linear model, whose predictions only depend on coef_ and intercept_.
+	'''
+	clf = getattr(classifier, '_clf', None)
+	
+	if clf is None or not hasattr(classifier, '_vectorizer') or not hasattr(clf, 'coef_'):
+		return False
+	
+	try:
+		from sklearn.linear_model._base import LinearClassifierMixin
+	except ImportError:
+		from sklearn.linear_model.base import LinearClassifierMixin
+	
+	return isinstance(clf, LinearClassifierMixin)
+
+def _linear_parts(classifier):
+	# returns (feature_names, coef, intercept, classes)
+	if isinstance(classifier, LinearClassifier):
+		stack = classifier._stack
+		return stack.feature_names, stack.weights, stack.intercepts, classifier.labels()
+	
+	coef = classifier._clf.coef_
+	
+	if sparse.issparse(coef):
+		coef = coef.toarray()
+	
+	return classifier._vectorizer.feature_names_, coef, classifier._clf.intercept_, classifier._encoder.classes_.tolist()
+
+def is_linear(classifier):
+	return isinstance(classifier, LinearClassifier) or is_linear_sklearn(classifier)
+
+def _is_binary_linear(classifier):
+	# binary linear models have a single row of weights
+	return is_linear(classifier) and len(classifier.labels()) == 2
+
+def _separator(classifier):
+	if isinstance(classifier, LinearClassifier):
+		return classifier._stack.separator
+	
+	return classifier._vectorizer.separator
+
+def _stackable(members, stackable):
+	# the (key, classifier) members that can share a LinearStack, which
+	# needs one separator to name string features
+	linear = [(key, c) for key, c in members if stackable(c)]
+	
+	if not linear:
+		return linear
+	
+	separator = _separator(linear[0][1])
+	return [(key, c) for key, c in linear if _separator(c) == separator]
+
+class LinearStack(object):
+	'''
+	The weights and intercepts of many linear models over one shared feature
+	vocabulary, so featuresets are vectorized once and scored by every model
+	with a single matrix multiply.
+	'''
+	def __init__(self, feature_names, weights, intercepts, separator='=', vocabulary=None):
+		self.feature_names = feature_names
+		self.weights = weights
+		self.intercepts = intercepts
+		self.separator = separator
+		
+		if vocabulary is None:
+			vocabulary = dict([(name, i) for i, name in enumerate(feature_names)])
+		
+		self.vocabulary = vocabulary
+	
+	@classmethod
+	def from_classifiers(cls, classifiers):
+		'''
+		Stacks the weight rows of linear SklearnClassifiers or
+		LinearClassifiers, in order, into one weight matrix over the union
+		of their vocabularies. They must all use the same separator.
+		'''
+		parts = [_linear_parts(classifier) for classifier in classifiers]
+		vocabulary = {}
+		
+		for names, coef, intercept, classes in parts:
+			for name in names:
+				vocabulary.setdefault(name, len(vocabulary))
+		
+		nrows = sum([coef.shape[0] for names, coef, intercept, classes in parts])
+		weights = numpy.zeros((nrows, len(vocabulary)))
+		intercepts = numpy.zeros(nrows)
+		row = 0
+		
+		for names, coef, intercept, classes in parts:
+			cols = [vocabulary[name] for name in names]
+			weights[row:row + coef.shape[0], cols] = coef
+			intercepts[row:row + coef.shape[0]] = intercept
+			row += coef.shape[0]
+		
+		feature_names = sorted(vocabulary, key=vocabulary.get)
+		separators = set([_separator(c) for c in classifiers])
+		
+		if len(separators) > 1:
+			raise ValueError('cannot stack classifiers with separators %r' % sorted(separators))
+		
+		return cls(feature_names, weights, intercepts, separators.pop() if separators else '=', vocabulary)
+	
+	def rows(self, start, end):
+		'''
+		Returns a LinearStack of just the models in rows start to end, that
+		shares this stack's vocabulary and a view of its weights.
+		'''
+		return LinearStack(self.feature_names, self.weights[start:end], self.intercepts[start:end], self.separator, self.vocabulary)
+	
+	def vectorize(self, featuresets):
+		'''
+		Returns a sparse matrix with a row for each featureset, encoded the
+		same way as DictVectorizer, so a string value is a name=value
+		feature, and an iterable of strings is one for each string. Unknown
+		features are ignored.
+		
+		>>> stack = LinearStack(['a', 'b=x', 'b=y'], numpy.ones((1, 3)), numpy.zeros(1))
+		>>> stack.vectorize([{'a': 2, 'b': 'x'}, {'b': ['x', 'y', 'z']}]).toarray().tolist()
+		[[2.0, 1.0, 0.0], [0.0, 1.0, 1.0]]
+		'''
+		indptr = [0]
+		indices = []
+		data = []
+		
+		for feats in featuresets:
+			for name, val in feats.items():
+				if isinstance(val, str):
+					items = [('%s%s%s' % (name, self.separator, val), 1)]
+				elif isinstance(val, Iterable) and not isinstance(val, Mapping):
+					items = [('%s%s%s' % (name, self.separator, v), 1) for v in val]
+				else:
+					items = [(name, val)]
+				
+				for feature, value in items:
+					col = self.vocabulary.get(feature)
+					
+					if col is not None:
+						indices.append(col)
+						data.append(value)
+			
+			indptr.append(len(indices))
+		
+		shape = (len(indptr) - 1, len(self.vocabulary))
+		return sparse.csr_matrix((numpy.array(data, dtype=float), indices, indptr), shape=shape)
+	
+	def decision_function(self, featuresets):
+		'''
+		Returns an array with a row for each featureset, and a column for
+		each stacked model.
+		'''
+		X = self.vectorize(featuresets)
+		return numpy.asarray(X.dot(numpy.asarray(self.weights).T)) + self.intercepts
+
+class LinearClassifier(ClassifierI):
+	'''
+	Classifies the same way as a linear SklearnClassifier, using the rows
+	of a LinearStack, without needing scikit-learn.
+	'''
+	def __init__(self, stack, classes):
+		self._stack = stack
+		self._classes = classes
+	
+	def labels(self):
+		return list(self._classes)
+	
+	def classify(self, feats):
+		return self.classify_many([feats])[0]
+	
+	def classify_many(self, featuresets):
+		scores = self._stack.decision_function(featuresets)
+		
+		if scores.shape[1] == 1:
+			indices = (scores[:, 0] > 0).astype(int)
+		else:
+			indices = scores.argmax(axis=1)
+		
+		return [self._classes[i] for i in indices]
 
 class MultiBinaryClassifier(MultiClassifierI):
-	def __init__(self, *label_classifiers):
+	'''
+	Returns the set of labels whose binary classifier chose that label. With
+	stack=True, the binary classifiers that are linear SklearnClassifiers or
+	LinearClassifiers are combined into a LinearStack, so each featureset is vectorized once
+	and scored for all those labels together. The other classifiers, and
+	any whose vectorizer separator differs from the first stacked one, are
+	still called one label at a time.
+	'''
+	def __init__(self, *label_classifiers, stack=False):
 		self._label_classifiers = dict(label_classifiers)
 		self._labels = sorted(self._label_classifiers.keys())
+		self._stack = None
+		self._looped = self._label_classifiers
+		
+		if stack:
+			members = [(label, self._label_classifiers[label]) for label in self._labels]
+			stacked = _stackable(members, _is_binary_linear)
+			
+			if stacked:
+				self._use_stack(LinearStack.from_classifiers([c for label, c in stacked]), [label for label, c in stacked])
+	
+	def _use_stack(self, stack, stacked_labels):
+		# row i of the stack is the binary model for stacked_labels[i]
+		self._stack = stack
+		self._stacked_labels = stacked_labels
+		# a binary linear model chooses its second class when its decision is > 0
+		self._positive = numpy.array([self._label_classifiers[label].labels()[1] == label for label in stacked_labels])
+		self._looped = dict([(label, c) for label, c in self._label_classifiers.items() if label not in set(stacked_labels)])
 	
 	def labels(self):
 		return self._labels
 	
 	def classify(self, feats):
-		lbls = set()
+		return self.classify_many([feats])[0]
+	
+	def classify_many(self, featuresets):
+		featuresets = list(featuresets)
+		lbls = [set() for feats in featuresets]
 		
-		for label, classifier in self._label_classifiers.items():
-			if classifier.classify(feats) == label:
-				lbls.add(label)
+		if self._stack is not None and featuresets:
+			chosen = (self._stack.decision_function(featuresets) > 0) == self._positive
+			
+			for i, j in zip(*numpy.nonzero(chosen)):
+				lbls[i].add(self._stacked_labels[j])
+		
+		for label, classifier in self._looped.items():
+			for guessed, observed in zip(lbls, classify_many(classifier, featuresets)):
+				if observed == label:
+					guessed.add(label)
 		
 		return lbls
 
@@ -73,28 +559,164 @@ def train_binary_classifiers(trainf, labelled_feats, labelset):
 	
 	return classifiers
 
-def multi_metrics(multi_classifier, test_feats):
-	mds = []
-	refsets = collections.defaultdict(set)
-	testsets = collections.defaultdict(set)
+def save_bundle(classifier, dirname):
+	'''
+	Saves a MultiBinaryClassifier or MaxVoteClassifier to the directory
+	dirname, for fast loading with load_bundle. The weights of all linear
+	classifiers are stacked into one numpy array over a vocabulary that is
+	stored once. Any other classifiers are pickled.
+	'''
+	if isinstance(classifier, MultiBinaryClassifier):
+		kind = 'multi_binary'
+		members = [(label, classifier._label_classifiers[label]) for label in classifier.labels()]
+		stackable = _is_binary_linear
+	elif isinstance(classifier, MaxVoteClassifier):
+		kind = 'max_vote'
+		members = list(enumerate(classifier._classifiers))
+		stackable = is_linear
+	else:
+		raise ValueError('cannot bundle %r' % classifier)
 	
-	for i, (feat, labels) in enumerate(test_feats):
-		for label in labels:
-			refsets[label].add(i)
-		
-		guessed = multi_classifier.classify(feat)
-		
-		for label in guessed:
-			testsets[label].add(i)
+	linear = _stackable(members, stackable)
+	stacked = set([key for key, c in linear])
+	stack = LinearStack.from_classifiers([c for key, c in linear])
+	rows = []
+	start = 0
+	
+	for key, c in linear:
+		names, coef, intercept, classes = _linear_parts(c)
+		rows.append((key, start, start + coef.shape[0], classes))
+		start += coef.shape[0]
+	
+	meta = {
+		'kind': kind,
+		'feature_names': stack.feature_names,
+		'separator': stack.separator,
+		'rows': rows,
+		'others': [(key, c) for key, c in members if key not in stacked],
+		'short_circuit': getattr(classifier, '_short_circuit', False)
+	}
+	
+	if not os.path.exists(dirname):
+		os.makedirs(dirname)
+	
+	numpy.save(os.path.join(dirname, 'weights.npy'), stack.weights)
+	numpy.save(os.path.join(dirname, 'intercepts.npy'), stack.intercepts)
+	
+	with open(os.path.join(dirname, 'bundle.pickle'), 'wb') as f:
+		pickle.dump(meta, f, pickle.HIGHEST_PROTOCOL)
+
+def load_bundle(dirname, mmap_mode='r', **kwargs):
+	'''
+	Loads a classifier saved by save_bundle. By default the weights are
+	memory-mapped read only, so loading doesn't read them, and processes
+	that load the same bundle share its pages. The linear classifiers are
+	loaded as LinearClassifiers, and a MultiBinaryClassifier is stacked.
+	Any kwargs are passed to the classifier constructor.
+	'''
+	with open(os.path.join(dirname, 'bundle.pickle'), 'rb') as f:
+		meta = pickle.load(f)
+	
+	weights = numpy.load(os.path.join(dirname, 'weights.npy'), mmap_mode=mmap_mode)
+	intercepts = numpy.load(os.path.join(dirname, 'intercepts.npy'), mmap_mode=mmap_mode)
+	stack = LinearStack(meta['feature_names'], weights, intercepts, meta['separator'])
+	members = dict(meta['others'])
+	
+	for key, start, end, classes in meta['rows']:
+		members[key] = LinearClassifier(stack.rows(start, end), classes)
+	
+	if meta['kind'] == 'multi_binary':
+		classifier = MultiBinaryClassifier(*members.items(), **kwargs)
+		classifier._use_stack(stack, [key for key, start, end, classes in meta['rows']])
+		return classifier
+	else:
+		kwargs.setdefault('short_circuit', meta['short_circuit'])
+		return MaxVoteClassifier(*[members[i] for i in range(len(members))], **kwargs)
+
+# set in each training process by _init_training, so the feature matrix
+# is shared with the workers instead of being sent for every label
+_training = {}
+
+def _init_training(X, label_lists):
+	_training['X'] = X
+	_training['label_lists'] = label_lists
+
+def _fit_binary(estimator, X, label_lists, label):
+	from sklearn.base import clone
+	from sklearn.preprocessing import LabelEncoder
+	
+	y = [label if label in labels else '!%s' % label for labels in label_lists]
+	encoder = LabelEncoder()
+	y = encoder.fit_transform(y)
+	start = time.time()
+	clf = clone(estimator).fit(X, y)
+	return label, clf, encoder, time.time() - start
+
+def _fit_binary_shared(args):
+	estimator, label = args
+	return _fit_binary(estimator, _training['X'], _training['label_lists'], label)
+
+def train_sklearn_binary_classifiers(estimator, labelled_feats, labelset, processes=None):
+	'''
+	Like train_binary_classifiers, but for a scikit-learn estimator. The
+	features are vectorized once, and every label's classifier is trained on
+	the same matrix, instead of building positive and negative lists per
+	label. If processes is given, the labels are trained in a
+	multiprocessing pool whose workers share the matrix. Returns the
+	classifiers, which all share one DictVectorizer, and a dict of label to
+	training time in seconds.
+	
+	Training examples are in corpus order rather than positives first, so
+	estimators that depend on sample order may differ slightly from
+	train_binary_classifiers.
+	'''
+	from nltk.classify.scikitlearn import SklearnClassifier
+	
+	labelled_feats = list(labelled_feats)
+	classifier = SklearnClassifier(estimator)
+	vectorizer = classifier._vectorizer
+	X = vectorizer.fit_transform([feat for feat, labels in labelled_feats])
+	label_lists = [set(labels) for feat, labels in labelled_feats]
+	
+	if processes:
+		# with fork, workers inherit X and label_lists without pickling them
+		pool = multiprocessing.Pool(processes, _init_training, (X, label_lists))
 		
-		mds.append(metrics.masi_distance(set(labels), guessed))
+		try:
+			results = pool.map(_fit_binary_shared, [(estimator, label) for label in labelset])
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		results = [_fit_binary(estimator, X, label_lists, label) for label in labelset]
 	
-	avg_md = sum(mds) / float(len(mds))
-	precisions = {}
-	recalls = {}
+	classifiers = {}
+	train_times = {}
+	
+	for label, clf, encoder, seconds in results:
+		classifier = SklearnClassifier(clf)
+		classifier._vectorizer = vectorizer
+		classifier._encoder = encoder
+		classifiers[label] = classifier
+		train_times[label] = seconds
+	
+	return classifiers, train_times
+
+def multi_metrics(multi_classifier, test_feats, processes=None):
+	labels = multi_classifier.labels()
+	index = dict([(label, i) for i, label in enumerate(labels)])
+	test_feats = list(test_feats)
+	guesses = classify_many(multi_classifier, [feat for feat, lbls in test_feats], processes=processes)
+	refs = numpy.zeros((len(test_feats), len(labels)), dtype=bool)
+	tests = numpy.zeros((len(test_feats), len(labels)), dtype=bool)
+	mds = []
 	
-	for label in multi_classifier.labels():
-		precisions[label] = metrics.precision(refsets[label], testsets[label])
-		recalls[label] = metrics.recall(refsets[label], testsets[label])
+	for i, ((feat, lbls), guessed) in enumerate(zip(test_feats, guesses)):
+		refs[i, [index[label] for label in lbls if label in index]] = True
+		tests[i, [index[label] for label in guessed if label in index]] = True
+		mds.append(metrics.masi_distance(set(lbls), set(guessed)))
 	
+	avg_md = sum(mds) / float(len(mds))
+	true_pos = (refs & tests).sum(axis=0)
+	precisions, recalls = _precisions_recalls(labels, true_pos, refs.sum(axis=0), tests.sum(axis=0))
 	return precisions, recalls, avg_md
\ No newline at end of file
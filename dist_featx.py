@@ -1,10 +1,166 @@
-import itertools, execnet, remote_word_count
+import itertools, execnet, numpy, remote_word_count
+from featx import array_scores
 from nltk.metrics import BigramAssocMeasures
-from redis import Redis
+from localredis import connect
 from redisprob import RedisHashFreqDist, RedisConditionalHashFreqDist
-from rediscollections import RedisOrderedDict
+from rediscollections import RedisOrderedDict, expire_keys, unlink_keys
 
-def score_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq, host='localhost', specs=[('popen', 2)]):
+# KEYS = word fd, label word fd, word scores; ARGV = n_xi, n_xx
+CHI_SQ_SCRIPT = """
+local n_xi = tonumber(ARGV[1])
+local n_xx = tonumber(ARGV[2])
+local items = redis.call('HGETALL', KEYS[2])
+
+for i = 1, #items, 2 do
+	local word = items[i]
+	local n_ii = tonumber(items[i + 1])
+	local n_ix = tonumber(redis.call('HGET', KEYS[1], word) or 0)
+	
+	if n_ii > 0 and n_ix > 0 and n_xi > 0 and n_xx > 0 then
+		local n_oi = n_xi - n_ii
+		local n_io = n_ix - n_ii
+		local n_oo = n_xx - n_ii - n_oi - n_io
+		local denom = (n_ii + n_io) * (n_ii + n_oi) * (n_io + n_oo) * (n_oi + n_oo)
+		
+		if denom > 0 then
+			local score = n_xx * (n_ii * n_oo - n_io * n_oi) ^ 2 / denom
+			local old = redis.call('ZSCORE', KEYS[3], word)
+			
+			if not old or score > tonumber(old) then
+				redis.call('ZADD', KEYS[3], string.format('%.17g', score), word)
+			end
+		end
+	end
+end
+
+return #items / 2
+"""
+
+def _update_max(word_scores, scores):
+	# a word keeps its highest score of any label, so it's kept by a
+	# min_score threshold if it's high information for any label
+	scores = list(scores)
+	old = word_scores.get_many([word for (word, score) in scores])
+	word_scores.update([(word, score) for ((word, score), prev) in zip(scores, old) if prev is None or score > prev])
+
+def _score_label(fd, label_fd, word_scores, score_fn, n_xi, n_xx):
+	scores = {}
+	
+	for word, n_ii in label_fd.items():
+		word = word.decode() # must convert to string from bytes
+		n_ix = fd[word]
+		
+		if n_ii and n_ix and n_xi and n_xx:
+			scores[word] = score_fn(n_ii, (n_ix, n_xi), n_xx)
+	
+	_update_max(word_scores, scores.items())
+
+def _score_label_array(fd, label_fd, word_scores, score_fn, n_xi, n_xx):
+	items = label_fd.items()
+	words = numpy.array([word.decode() for word, n_ii in items], dtype=object)
+	n_ii = numpy.array([n_ii for word, n_ii in items], dtype=numpy.float64)
+	n_ix = numpy.array(fd.get_many(words), dtype=numpy.float64)
+	
+	if not (n_xi and n_xx):
+		return
+	
+	scores = array_scores(score_fn, n_ii, (n_ix, float(n_xi)), float(n_xx))
+	scored = (n_ii > 0) & (n_ix > 0) & numpy.isfinite(scores)
+	_update_max(word_scores, zip(words[scored], scores[scored].tolist()))
+
+def high_score_words(word_scores, min_score=5, page_size=1000):
+	'''
+	Yields the words of a RedisOrderedDict of word scores with a score of
+	at least min_score, highest first, paging them out of redis instead of
+	thresholding every score in memory. score_words keeps the highest
+	score of each word over all labels, so for its scores these are the
+	words featx.high_information_words would find.
+	
+	>>> from localredis import LocalRedis
+	>>> word_scores = RedisOrderedDict(LocalRedis(), 'word_scores')
+	>>> word_scores.update({'bad': 10.5, 'good': 5, 'the': 0.1})
+	>>> list(high_score_words(word_scores, page_size=1))
+	[b'bad', b'good']
+	'''
+	for word, score in word_scores.range_by_score(min=min_score, page_size=page_size):
+		yield word
+
+def word_chunks(labelled_words, chunk_size=10000):
+	'''
+	Yields (label, words) with at most chunk_size words, without reading
+	more than one chunk of a label's words into memory at a time.
+	
+	>>> list(word_chunks([('pos', ['a', 'b', 'c']), ('neg', ['d'])], chunk_size=2))
+	[('pos', ['a', 'b']), ('pos', ['c']), ('neg', ['d'])]
+	'''
+	for label, words in labelled_words:
+		words = iter(words)
+		chunk = list(itertools.islice(words, chunk_size))
+		
+		while chunk:
+			yield label, chunk
+			chunk = list(itertools.islice(words, chunk_size))
+
+def _collections(r, namespace=None):
+	names = ['word_fd', 'label_word_fd', 'word_scores']
+	
+	if namespace:
+		names = ['%s:%s' % (namespace, name) for name in names]
+	
+	fd_name, cfd_name, scores_name = names
+	return RedisHashFreqDist(r, fd_name), RedisConditionalHashFreqDist(r, cfd_name), RedisOrderedDict(r, scores_name)
+
+def clear_score_words(host='localhost', namespace=None, unlink=True):
+	'''
+	Removes every key of a score_words run, counts and scores, in one
+	pipeline of UNLINK commands, or DEL with unlink=False for servers older
+	than redis 4.0. Returns the number of keys removed.
+	
+	>>> from localredis import LocalRedisManager
+	>>> manager = LocalRedisManager(address=('127.0.0.1', 0), authkey=b'secret')
+	>>> manager.start()
+	>>> host = (manager.address, b'secret')
+	>>> fd, cfd, word_scores = _collections(connect(host), namespace='run1')
+	>>> fd.update(['good'])
+	>>> cfd['pos'].update(['good'])
+	>>> word_scores['good'] = 1.0
+	>>> clear_score_words(host, namespace='run1')
+	5
+	>>> clear_score_words(host, namespace='run1')
+	0
+	>>> manager.shutdown()
+	'''
+	fd, cfd, word_scores = _collections(connect(host), namespace=namespace)
+	names = fd.redis_keys() + cfd.redis_keys() + word_scores.redis_keys()
+	return unlink_keys(fd._r, names, unlink=unlink)
+
+def score_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq, host='localhost', specs=[('popen', 2)], flush_size=10000, scoring='python', chunk_size=10000, namespace=None, ttl=None):
+	'''
+	Counts words with remote execnet workers into Redis, then scores them.
+	host is a Redis host name, or to run without a Redis server, the
+	(address, authkey) of a started localredis.LocalRedisManager. Words are
+	sent in chunks of chunk_size to whichever worker asks for more work.
+	
+	Each word's score is its highest score for any label. scoring chooses
+	how the counted words are scored:
+	
+	* python: calls score_fn for each word, fetching its count separately
+	* array: fetches each label's counts in bulk, and scores them all at
+	  once with featx.array_scores
+	* lua: scores chi_sq inside Redis with CHI_SQ_SCRIPT, so no counts or
+	  scores go over the wire. Needs a real Redis server.
+	
+	Keys are prefixed with namespace, so runs with different namespaces can
+	share a Redis server. If ttl is given, every key expires ttl seconds
+	after it was last written, from the first counts the workers write, so
+	keys of a run that fails or is abandoned don't stay forever. Remove
+	them with clear_score_words.
+	'''
+	if scoring == 'lua' and score_fn != BigramAssocMeasures.chi_sq:
+		raise ValueError('lua scoring only supports BigramAssocMeasures.chi_sq')
+	
+	r = connect(host)
+	fd, cfd, word_scores = _collections(r, namespace=namespace)
 	gateways = []
 	channels = []
 	
@@ -13,38 +169,59 @@ def score_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq, host='local
 			gw = execnet.makegateway(spec)
 			gateways.append(gw)
 			channel = gw.remote_exec(remote_word_count)
-			channel.send((host, 'word_fd', 'label_word_fd'))
+			channel.send((host, fd._name, cfd._name, flush_size, ttl))
 			channels.append(channel)
 	
-	cyc = itertools.cycle(channels)
-	
-	for label, words in labelled_words:
-		channel = next(cyc)
-		channel.send((label, list(words)))
+	closed = object()
+	queue = execnet.MultiChannel(channels).make_receive_queue(endmarker=closed)
+	chunks = word_chunks(labelled_words, chunk_size=chunk_size)
+	working = set(channels)
 	
-	for channel in channels:
-		channel.send('done')
-		assert 'done' == channel.receive()
-		channel.waitclose(5)
-	
-	for gateway in gateways:
-		gateway.exit()
+	try:
+		while working:
+			channel, msg = queue.get()
+			
+			if msg is closed:
+				if channel in working:
+					# raises the RemoteError the worker closed with, if any
+					channel.waitclose(0)
+					raise RuntimeError('a worker closed before counting all its words')
+			elif msg == 'ready':
+				chunk = next(chunks, None)
+				channel.send('done' if chunk is None else chunk)
+			else:
+				assert 'done' == msg
+				working.remove(channel)
+		
+		for channel in channels:
+			channel.waitclose(5)
+	finally:
+		for gateway in gateways:
+			gateway.exit()
 	
-	r = Redis(host)
-	fd = RedisHashFreqDist(r, 'word_fd')
-	cfd = RedisConditionalHashFreqDist(r, 'label_word_fd')
-	word_scores = RedisOrderedDict(r, 'word_scores')
 	n_xx = cfd.N()
 	
-	for label in cfd.conditions():
-		n_xi = cfd[label].N()
-		
-		for word, n_ii in cfd[label].items():
-			word = word.decode() # must convert to string from bytes
-			n_ix = fd[word]
+	if scoring == 'lua':
+		script = r.register_script(CHI_SQ_SCRIPT)
+	
+	try:
+		for label in cfd.conditions():
+			n_xi = cfd[label].N()
 			
-			if n_ii and n_ix and n_xi and n_xx:
-				score = score_fn(n_ii, (n_ix, n_xi), n_xx)
-				word_scores[word] = score
+			if scoring == 'lua':
+				script(keys=[fd._name, cfd[label]._name, word_scores._name], args=[n_xi, n_xx])
+			elif scoring == 'array':
+				_score_label_array(fd, cfd[label], word_scores, score_fn, n_xi, n_xx)
+			else:
+				_score_label(fd, cfd[label], word_scores, score_fn, n_xi, n_xx)
+	finally:
+		# workers expire the counts as they write them, this covers the
+		# scores, even if scoring fails
+		if ttl:
+			expire_keys(r, fd.redis_keys() + cfd.redis_keys() + word_scores.redis_keys(), ttl)
 	
-	return word_scores
\ No newline at end of file
+	return word_scores
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
\ No newline at end of file
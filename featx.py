@@ -1,8 +1,9 @@
-import collections
+import collections, itertools, numpy, os, pickle
 from nltk.corpus import stopwords, reuters
 from nltk.collocations import BigramCollocationFinder
 from nltk.metrics import BigramAssocMeasures
 from nltk.probability import FreqDist, ConditionalFreqDist
+from sketches import CountMinSketch, HeavyHitters
 
 def bag_of_words(words):
 	'''
@@ -85,15 +86,251 @@ def high_information_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq,
 	
 	return high_info_words
 
-def reuters_high_info_words(score_fn=BigramAssocMeasures.chi_sq):
+def label_word_counts(labelled_words):
+	'''
+	Returns (labels, words, counts), where counts is a numpy array with a row
+	of word counts for each label and a column for each word.
+	
+	>>> labels, words, counts = label_word_counts([('pos', ['good', 'movie']), ('neg', ['bad', 'bad', 'movie'])])
+	>>> labels, words
+	(['pos', 'neg'], ['good', 'movie', 'bad'])
+	>>> counts.tolist()
+	[[1, 1, 0], [0, 1, 2]]
+	'''
+	label_fds = collections.OrderedDict()
+	
+	for label, words in labelled_words:
+		label_fds.setdefault(label, collections.Counter()).update(words)
+	
+	vocab = {}
+	
+	for fd in label_fds.values():
+		for word in fd:
+			vocab.setdefault(word, len(vocab))
+	
+	counts = numpy.zeros((len(label_fds), len(vocab)), dtype=numpy.int64)
+	
+	for row, fd in enumerate(label_fds.values()):
+		cols = numpy.fromiter((vocab[word] for word in fd), dtype=numpy.intp, count=len(fd))
+		counts[row, cols] = numpy.fromiter(fd.values(), dtype=numpy.int64, count=len(fd))
+	
+	return list(label_fds.keys()), sorted(vocab, key=vocab.get), counts
+
+###########################################
+## numpy versions of BigramAssocMeasures ##
+###########################################
+
+_SMALL = 1e-20
+
+def _array_contingency(n_ii, n_ix_xi_tuple, n_xx):
+	(n_ix, n_xi) = n_ix_xi_tuple
+	n_oi = n_xi - n_ii
+	n_io = n_ix - n_ii
+	return (n_ii, n_oi, n_io, n_xx - n_ii - n_oi - n_io)
+
+def array_raw_freq(n_ii, n_ix_xi_tuple, n_xx):
+	return n_ii / n_xx
+
+def array_student_t(n_ii, n_ix_xi_tuple, n_xx):
+	(n_ix, n_xi) = n_ix_xi_tuple
+	return (n_ii - n_ix * n_xi / n_xx) / numpy.sqrt(n_ii + _SMALL)
+
+def array_phi_sq(n_ii, n_ix_xi_tuple, n_xx):
+	n_ii, n_io, n_oi, n_oo = _array_contingency(n_ii, n_ix_xi_tuple, n_xx)
+	return (n_ii * n_oo - n_io * n_oi) ** 2 / ((n_ii + n_io) * (n_ii + n_oi) * (n_io + n_oo) * (n_oi + n_oo))
+
+def array_chi_sq(n_ii, n_ix_xi_tuple, n_xx):
+	return n_xx * array_phi_sq(n_ii, n_ix_xi_tuple, n_xx)
+
+def array_pmi(n_ii, n_ix_xi_tuple, n_xx):
+	(n_ix, n_xi) = n_ix_xi_tuple
+	return numpy.log2(n_ii * n_xx) - numpy.log2(n_ix * n_xi)
+
+def array_likelihood_ratio(n_ii, n_ix_xi_tuple, n_xx):
+	cont = _array_contingency(n_ii, n_ix_xi_tuple, n_xx)
+	score = 0
+	
+	for i in range(4):
+		exp = (cont[i] + cont[i ^ 1]) * (cont[i] + cont[i ^ 2]) / n_xx
+		score = score + cont[i] * numpy.log(cont[i] / (exp + _SMALL) + _SMALL)
+	
+	return 2 * score
+
+def array_poisson_stirling(n_ii, n_ix_xi_tuple, n_xx):
+	(n_ix, n_xi) = n_ix_xi_tuple
+	exp = n_ix * n_xi / n_xx
+	return n_ii * (numpy.log2(n_ii / exp) - 1)
+
+def array_jaccard(n_ii, n_ix_xi_tuple, n_xx):
+	cont = _array_contingency(n_ii, n_ix_xi_tuple, n_xx)
+	return cont[0] / sum(cont[:-1])
+
+def array_dice(n_ii, n_ix_xi_tuple, n_xx):
+	(n_ix, n_xi) = n_ix_xi_tuple
+	return 2 * n_ii / (n_ix + n_xi)
+
+array_score_fns = {
+	BigramAssocMeasures.raw_freq: array_raw_freq,
+	BigramAssocMeasures.student_t: array_student_t,
+	BigramAssocMeasures.phi_sq: array_phi_sq,
+	BigramAssocMeasures.chi_sq: array_chi_sq,
+	BigramAssocMeasures.pmi: array_pmi,
+	BigramAssocMeasures.likelihood_ratio: array_likelihood_ratio,
+	BigramAssocMeasures.poisson_stirling: array_poisson_stirling,
+	BigramAssocMeasures.jaccard: array_jaccard,
+	BigramAssocMeasures.dice: array_dice
+}
+
+def array_scores(score_fn, n_ii, n_ix_xi_tuple, n_xx):
+	'''
+	Scores every cell of the n_ii array at once. Known BigramAssocMeasures
+	use their numpy versions, any other score_fn is called per cell, only
+	for cells with n_ii > 0 like high_information_words, and the other
+	cells are nan.
+	
+	>>> array_scores(BigramAssocMeasures.chi_sq, numpy.array([2.0, 1.0]), (numpy.array([2.0, 2.0]), 2.0), 4.0).tolist()
+	[4.0, 0.0]
+	>>> import math
+	>>> array_scores(lambda n_ii, n_ix_xi_tuple, n_xx: math.log(n_ii), numpy.array([1.0, 0.0]), (numpy.array([1.0, 1.0]), 1.0), 2.0).tolist()
+	[0.0, nan]
+	'''
+	(n_ix, n_xi) = n_ix_xi_tuple
+	array_fn = array_score_fns.get(score_fn)
+	
+	with numpy.errstate(divide='ignore', invalid='ignore'):
+		if array_fn:
+			return array_fn(n_ii, (n_ix, n_xi), n_xx)
+		
+		vector_fn = numpy.vectorize(lambda ii, ix, xi: score_fn(ii, (ix, xi), n_xx), otypes=[numpy.float64])
+		n_ii, n_ix, n_xi = numpy.broadcast_arrays(n_ii, n_ix, n_xi)
+		scores = numpy.full(n_ii.shape, numpy.nan)
+		scored = n_ii > 0
+		scores[scored] = vector_fn(n_ii[scored], n_ix[scored], n_xi[scored])
+		return scores
+
+def array_high_information_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq, min_score=5):
+	'''
+	Same as high_information_words, but scores every (label, word) pair in
+	one pass over a label x word count matrix.
+	
+	>>> labelled_words = [('pos', ['good', 'great', 'movie'] * 3), ('neg', ['bad', 'awful', 'movie'] * 3)]
+	>>> sorted(array_high_information_words(labelled_words, min_score=3))
+	['awful', 'bad', 'good', 'great']
+	>>> array_high_information_words(labelled_words, min_score=3) == high_information_words(labelled_words, min_score=3)
+	True
+	'''
+	labels, words, counts = label_word_counts(labelled_words)
+	n_ii = counts.astype(numpy.float64)
+	n_ix = n_ii.sum(axis=0)
+	n_xi = n_ii.sum(axis=1)[:, numpy.newaxis]
+	n_xx = n_ii.sum()
+	scores = array_scores(score_fn, n_ii, (n_ix, n_xi), n_xx)
+	# only words that occur with a label are scored for it, as in high_information_words
+	best = ((counts > 0) & (scores >= min_score)).any(axis=0)
+	return set(numpy.array(words, dtype=object)[best])
+
+def approx_high_information_words(labelled_words, score_fn=BigramAssocMeasures.chi_sq, min_score=5, epsilon=0.0001, delta=0.01, k=10000, batch_size=10000):
+	'''
+	Streaming version of high_information_words for when the word counts do
+	not fit in memory. Word totals go into a CountMinSketch, and each label
+	keeps a HeavyHitters summary of its most frequent words, so memory is
+	bounded by e / epsilon * ln(1 / delta) + 2 * k * len(labels) counters.
+	
+	A label's summary only knows each word's count with the label (n_ii) to
+	within its error(), at most n_xi / (k + 1) for a label with n_xi words,
+	so a word is chosen for a label only if it scores at least min_score at
+	both ends of that range, and the range doesn't include the count the
+	word would have if it were independent of the label, where chi_sq and
+	the like score 0. So, for such score functions:
+	
+	* every word chosen is a high information word, as long as its total
+	  count (n_ix) is within epsilon * N of the truth, which it is with
+	  probability 1 - delta
+	* only words that occur more than error() times with a label can be
+	  chosen for that label, so rarer words are missed, as are words whose
+	  n_ii range is too wide to be sure of
+	
+	If k is at least the vocabulary size of every label, nothing is ever
+	reduced, n_ii is exact, and the words are those high_information_words
+	finds, bar count-min sketch errors. A smaller k saves memory by missing
+	words, rather than by choosing wrong ones.
+	
+	>>> labelled_words = [('pos', ['good', 'great', 'movie'] * 3), ('neg', ['bad', 'awful', 'movie'] * 3)]
+	>>> sorted(approx_high_information_words(labelled_words, min_score=3))
+	['awful', 'bad', 'good', 'great']
+	>>> labelled_words = [('pos', ['good'] * 20 + ['the'] * 20 + ['a', 'b', 'c', 'd']), ('neg', ['bad'] * 20 + ['the'] * 20 + ['e', 'f', 'g', 'h'])]
+	>>> sorted(approx_high_information_words(labelled_words, min_score=3, k=2))
+	['bad', 'good']
+	'''
+	word_cms = CountMinSketch(epsilon=epsilon, delta=delta)
+	label_hhs = collections.OrderedDict()
+	
+	for label, words in labelled_words:
+		hh = label_hhs.setdefault(label, HeavyHitters(k=k))
+		words = iter(words)
+		batch = collections.Counter(itertools.islice(words, batch_size))
+		
+		while batch:
+			word_cms.update(batch)
+			hh.update(batch)
+			batch = collections.Counter(itertools.islice(words, batch_size))
+	
+	n_xx = float(word_cms.N())
+	high_info_words = set()
+	
+	for label, hh in label_hhs.items():
+		n_xi = float(hh.N())
+		error = hh.error()
+		# a kept count of at most error() could be any word added since the
+		# last reduction, so only words surely more common than that count
+		items = [(word, n_ii) for word, n_ii in hh.items() if n_ii > error]
+		words = numpy.array([word for word, n_ii in items], dtype=object)
+		low = numpy.array([n_ii for word, n_ii in items], dtype=numpy.float64)
+		high = low + error
+		# a word can't occur less often overall than with one label
+		n_ix = numpy.maximum(numpy.array([word_cms[word] for word in words], dtype=numpy.float64), high)
+		expected = n_ix * n_xi / n_xx
+		scores = numpy.minimum(array_scores(score_fn, low, (n_ix, n_xi), n_xx), array_scores(score_fn, high, (n_ix, n_xi), n_xx))
+		# a range either side of independence could have a true score of 0
+		unsure = (low < high) & (low <= expected) & (expected <= high)
+		high_info_words |= set(words[(scores >= min_score) & ~unsure])
+	
+	return high_info_words
+
+def reuters_fileid_words(cache_file=None):
+	'''
+	Returns a dict of fileid to words for every file in the reuters corpus,
+	reading each file exactly once. If cache_file is given, the tokens are
+	loaded from it when it exists, or else pickled to it for next time.
+	'''
+	if cache_file and os.path.exists(cache_file):
+		with open(cache_file, 'rb') as f:
+			return pickle.load(f)
+	
+	fileid_words = dict([(fileid, list(reuters.words(fileid))) for fileid in reuters.fileids()])
+	
+	if cache_file:
+		with open(cache_file, 'wb') as f:
+			pickle.dump(fileid_words, f, pickle.HIGHEST_PROTOCOL)
+	
+	return fileid_words
+
+def reuters_high_info_words(score_fn=BigramAssocMeasures.chi_sq, fileid_words=None):
+	if fileid_words is None:
+		fileid_words = reuters_fileid_words()
+	
 	labeled_words = []
 	
-	for label in reuters.categories():
-		labeled_words.append((label, reuters.words(categories=[label])))
+	for fileid, words in fileid_words.items():
+		for label in reuters.categories(fileid):
+			labeled_words.append((label, words))
 	
 	return high_information_words(labeled_words, score_fn=score_fn)
 
-def reuters_train_test_feats(feature_detector=bag_of_words):
+def reuters_train_test_feats(feature_detector=bag_of_words, fileid_words=None):
+	if fileid_words is None:
+		fileid_words = reuters_fileid_words()
+	
 	train_feats = []
 	test_feats = []
 	
@@ -103,7 +340,7 @@ def reuters_train_test_feats(feature_detector=bag_of_words):
 		else: # fileid.startswith('test')
 			featlist = test_feats
 		
-		feats = feature_detector(reuters.words(fileid))
+		feats = feature_detector(fileid_words[fileid])
 		labels = reuters.categories(fileid)
 		featlist.append((feats, labels))
 	
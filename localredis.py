@@ -0,0 +1,415 @@
+import itertools, threading, time
+from multiprocessing.managers import BaseManager, MakeProxyType
+from redis import Redis
+from redis.exceptions import WatchError
+
+def _b(val):
+	# redis stores everything as bytes
+	if isinstance(val, bytes):
+		return val
+	elif isinstance(val, str):
+		return val.encode()
+	else:
+		return repr(val).encode()
+
+def _bound(bound, exclusive, inclusive):
+	# a score range bound like redis: a number, '-inf', '+inf', or '(' for exclusive
+	if isinstance(bound, bytes):
+		bound = bound.decode()
+	
+	if isinstance(bound, str) and bound.startswith('('):
+		return lambda score: exclusive(score, float(bound[1:]))
+	else:
+		return lambda score: inclusive(score, float(bound))
+
+class LocalRedis(object):
+	'''
+	An in-process stand-in for redis.Redis, implementing the hash and sorted
+	set commands used by rediscollections and redisprob, with the same
+	return types. Every command, and every pipeline, runs under one lock.
+	
+	>>> from rediscollections import RedisOrderedDict
+	>>> from redisprob import RedisHashFreqDist
+	>>> r = LocalRedis()
+	>>> rhfd = RedisHashFreqDist(r, 'test')
+	>>> rhfd.update(['foo', 'bar', 'foo'])
+	>>> sorted(rhfd.items()), rhfd.N()
+	([(b'bar', 1), (b'foo', 2)], 3)
+	>>> rhfd['foo'] = 5
+	>>> rhfd.N()
+	6
+	>>> rod = RedisOrderedDict(r, 'scores')
+	>>> rod.update({'best': 10, 'worst': 0.1, 'middle': 5})
+	>>> rod.keys(start=0, end=1)
+	[b'best', b'middle']
+	>>> rod['middle']
+	5.0
+	>>> list(rod.range_by_score(min=1, max='(10'))
+	[(b'middle', 5.0)]
+	>>> from rediscollections import expire_keys, unlink_keys
+	>>> expire_keys(r, rod.redis_keys(), 60)
+	>>> 0 < r.ttl('scores') <= 60
+	True
+	>>> unlink_keys(r, rhfd.redis_keys() + rod.redis_keys())
+	3
+	'''
+	def __init__(self):
+		self._lock = threading.RLock()
+		self._data = {}
+		# sorted sets as score dicts, with a cache of their sorted items
+		self._sorted = {}
+		# key expiration times, keys are removed when next used after that
+		self._expires = {}
+		# the last write to each key, so WATCH can tell if a key changed
+		self._versions = {}
+		self._writes = itertools.count(1)
+	
+	def _touch(self, name):
+		self._versions[_b(name)] = next(self._writes)
+	
+	def _expire(self, name):
+		if name in self._expires and self._expires[name] <= time.time():
+			self._touch(name)
+			self._data.pop(name, None)
+			self._sorted.pop(name, None)
+			del self._expires[name]
+	
+	def _hash(self, name, create=False):
+		self._expire(_b(name))
+		
+		if create:
+			self._touch(name)
+			return self._data.setdefault(_b(name), {})
+		else:
+			return self._data.get(_b(name), {})
+	
+	def _zset(self, name, create=False):
+		self._touch(name)
+		self._sorted.pop(_b(name), None)
+		return self._hash(name, create=create)
+	
+	def _zitems(self, name):
+		name = _b(name)
+		self._expire(name)
+		
+		if name not in self._sorted:
+			items = self._data.get(name, {}).items()
+			self._sorted[name] = sorted(items, key=lambda item: (item[1], item[0]), reverse=True)
+		
+		return self._sorted[name]
+	
+	def _prune(self, name):
+		if not self._data.get(_b(name), True):
+			del self._data[_b(name)]
+	
+	def execute_pipeline(self, commands, watched=None):
+		'''
+		Runs a list of (method, args, kwargs) atomically, and returns the
+		list of results. watched is a list of (name, version) from versions,
+		and if any of those keys has been written since, nothing is run and
+		WatchError is raised, like redis does for WATCH.
+		'''
+		with self._lock:
+			if watched and self.versions([name for (name, version) in watched]) != watched:
+				raise WatchError('watched keys changed')
+			
+			return [getattr(self, method)(*args, **kwargs) for (method, args, kwargs) in commands]
+	
+	def versions(self, names):
+		with self._lock:
+			for name in names:
+				self._expire(_b(name))
+			
+			return [(name, self._versions.get(_b(name), 0)) for name in names]
+	
+	def pipeline(self, transaction=True, shard_hint=None):
+		return LocalPipeline(self)
+	
+	def transaction(self, func, *watches, **kwargs):
+		return _transaction(self, func, *watches)
+	
+	def execute_command(self, command, *args, **kwargs):
+		return getattr(self, command.lower())(*args, **kwargs)
+	
+	def delete(self, *names):
+		with self._lock:
+			deleted = 0
+			
+			for name in names:
+				self._expire(_b(name))
+				self._touch(name)
+				self._sorted.pop(_b(name), None)
+				self._expires.pop(_b(name), None)
+				
+				if self._data.pop(_b(name), None) is not None:
+					deleted += 1
+			
+			return deleted
+	
+	def unlink(self, *names):
+		return self.delete(*names)
+	
+	def expire(self, name, seconds):
+		with self._lock:
+			if not self._hash(name):
+				return False
+			
+			self._expires[_b(name)] = time.time() + seconds
+			return True
+	
+	def ttl(self, name):
+		with self._lock:
+			if not self._hash(name):
+				return -2
+			elif _b(name) not in self._expires:
+				return -1
+			
+			return int(round(self._expires[_b(name)] - time.time()))
+	
+	def flushall(self):
+		with self._lock:
+			for name in self._data:
+				self._touch(name)
+			
+			self._data.clear()
+			self._sorted.clear()
+			self._expires.clear()
+			return True
+	
+	def hget(self, name, key):
+		with self._lock:
+			return self._hash(name).get(_b(key))
+	
+	def hset(self, name, key, val):
+		with self._lock:
+			h = self._hash(name, create=True)
+			new = _b(key) not in h
+			h[_b(key)] = _b(val)
+			return int(new)
+	
+	def hdel(self, name, *keys):
+		with self._lock:
+			self._touch(name)
+			h = self._hash(name)
+			deleted = len([h.pop(_b(key)) for key in keys if _b(key) in h])
+			self._prune(name)
+			return deleted
+	
+	def hmget(self, name, keys, *args):
+		with self._lock:
+			h = self._hash(name)
+			return [h.get(_b(key)) for key in list(keys) + list(args)]
+	
+	def hexists(self, name, key):
+		with self._lock:
+			return _b(key) in self._hash(name)
+	
+	def hlen(self, name):
+		with self._lock:
+			return len(self._hash(name))
+	
+	def hkeys(self, name):
+		with self._lock:
+			return list(self._hash(name).keys())
+	
+	def hvals(self, name):
+		with self._lock:
+			return list(self._hash(name).values())
+	
+	def hgetall(self, name):
+		with self._lock:
+			return dict(self._hash(name))
+	
+	def hincrby(self, name, key, amount=1):
+		with self._lock:
+			h = self._hash(name, create=True)
+			val = int(h.get(_b(key), 0)) + amount
+			h[_b(key)] = _b(val)
+			return val
+	
+	def hscan_iter(self, name, match=None, count=None):
+		for item in self.hgetall(name).items():
+			yield item
+	
+	def zadd(self, name, *args, **kwargs):
+		# same arguments as redis.Redis: name1, score1, name2, score2, ...
+		pairs = list(zip(args[::2], args[1::2])) + list(kwargs.items())
+		
+		with self._lock:
+			z = self._zset(name, create=True)
+			added = len([key for key, score in pairs if _b(key) not in z])
+			
+			for key, score in pairs:
+				z[_b(key)] = float(score)
+			
+			return added
+	
+	def zrem(self, name, *keys):
+		with self._lock:
+			z = self._zset(name)
+			removed = len([z.pop(_b(key)) for key in keys if _b(key) in z])
+			self._prune(name)
+			return removed
+	
+	def zcard(self, name):
+		with self._lock:
+			return len(self._hash(name))
+	
+	def zscore(self, name, key):
+		with self._lock:
+			return self._hash(name).get(_b(key))
+	
+	def zrevrange(self, name, start, end, withscores=False, score_cast_func=float):
+		with self._lock:
+			items = self._zitems(name)
+			start = start + len(items) if start < 0 else start
+			end = end + len(items) if end < 0 else end
+			items = items[max(start, 0):end + 1]
+		
+		if withscores:
+			return [(key, score_cast_func(score)) for key, score in items]
+		else:
+			return [key for key, score in items]
+	
+	def zcount(self, name, min, max):
+		above = _bound(min, lambda score, bound: score > bound, lambda score, bound: score >= bound)
+		below = _bound(max, lambda score, bound: score < bound, lambda score, bound: score <= bound)
+		
+		with self._lock:
+			return len([score for score in self._hash(name).values() if above(score) and below(score)])
+	
+	def zrevrangebyscore(self, name, max, min, start=None, num=None, withscores=False, score_cast_func=float):
+		above = _bound(min, lambda score, bound: score > bound, lambda score, bound: score >= bound)
+		below = _bound(max, lambda score, bound: score < bound, lambda score, bound: score <= bound)
+		
+		with self._lock:
+			items = [(key, score) for key, score in self._zitems(name) if above(score) and below(score)]
+		
+		if start is not None and num is not None:
+			items = items[start:start + num] if num >= 0 else items[start:]
+		
+		if withscores:
+			return [(key, score_cast_func(score)) for key, score in items]
+		else:
+			return [key for key, score in items]
+
+class LocalPipeline(object):
+	'''
+	Queues commands like a redis pipeline, and sends them all to a
+	LocalRedis, or a proxy to one, in a single execute_pipeline call.
+	After watch, commands run right away until multi, and execute raises
+	WatchError if a watched key was written in between.
+	'''
+	def __init__(self, r):
+		self._r = r
+		self._commands = []
+		self._watched = None
+		self._immediate = False
+	
+	def watch(self, *names):
+		self._watched = self._r.versions(names)
+		self._immediate = True
+	
+	def multi(self):
+		self._immediate = False
+	
+	def __getattr__(self, method):
+		if self._immediate:
+			return getattr(self._r, method)
+		
+		def queue(*args, **kwargs):
+			self._commands.append((method, args, kwargs))
+			return self
+		
+		return queue
+	
+	def execute(self):
+		commands, self._commands = self._commands, []
+		watched, self._watched = self._watched, None
+		self._immediate = False
+		
+		if not (commands or watched):
+			return []
+		
+		return self._r.execute_pipeline(commands, watched)
+
+def _transaction(r, func, *watches):
+	# like redis.Redis.transaction: calls func with a pipeline watching
+	# watches, and runs it again if they were written before it executed
+	while True:
+		pipe = r.pipeline()
+		pipe.watch(*watches)
+		func(pipe)
+		
+		try:
+			return pipe.execute()
+		except WatchError:
+			continue
+
+###################################################
+## Sharing one LocalRedis between many processes ##
+###################################################
+
+_exposed = ('execute_pipeline', 'versions', 'execute_command', 'delete', 'unlink',
+	'expire', 'ttl', 'flushall', 'hget', 'hmget', 'hset', 'hdel', 'hexists', 'hlen',
+	'hkeys', 'hvals', 'hgetall', 'hincrby', 'zadd', 'zrem', 'zcard', 'zcount',
+	'zscore', 'zrevrange', 'zrevrangebyscore')
+
+class LocalRedisProxy(MakeProxyType('BaseLocalRedisProxy', _exposed)):
+	# pipelines and scan iterators live in the client process
+	
+	def pipeline(self, transaction=True, shard_hint=None):
+		return LocalPipeline(self)
+	
+	def transaction(self, func, *watches, **kwargs):
+		return _transaction(self, func, *watches)
+	
+	def hscan_iter(self, name, match=None, count=None):
+		for item in self.hgetall(name).items():
+			yield item
+
+_shared = None
+
+def _shared_redis():
+	global _shared
+	
+	if _shared is None:
+		_shared = LocalRedis()
+	
+	return _shared
+
+class LocalRedisManager(BaseManager):
+	'''
+	Serves a single LocalRedis from a manager process, so other processes
+	can share it by connecting to the manager's address.
+	
+	>>> manager = LocalRedisManager(address=('127.0.0.1', 0), authkey=b'secret')
+	>>> manager.start()
+	>>> r = connect((manager.address, b'secret'))
+	>>> r.hincrby('test', 'foo', 2)
+	2
+	>>> connect((manager.address, b'secret')).hget('test', 'foo')
+	b'2'
+	>>> manager.shutdown()
+	'''
+	pass
+
+LocalRedisManager.register('get_redis', callable=_shared_redis, proxytype=LocalRedisProxy)
+
+def connect(host='localhost'):
+	'''
+	Returns a redis.Redis client for a host name, or for an
+	(address, authkey) pair, a proxy to the LocalRedis of the
+	LocalRedisManager at that address.
+	'''
+	if isinstance(host, (tuple, list)):
+		address, authkey = host
+		manager = LocalRedisManager(address=tuple(address), authkey=authkey)
+		manager.connect()
+		return manager.get_redis()
+	else:
+		return Redis(host)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
\ No newline at end of file
@@ -1,31 +1,295 @@
-import itertools, execnet
+import collections, itertools, queue, time, execnet
 
-def map(mod, args, specs=[('popen', 2)]):
-	gateways = []
-	channels = []
+# sent to the receive queue in place of a message when a channel closes
+_closed = object()
+
+class TaskError(Exception):
+	'''
+	Raised, or returned in place of a result, for an arg whose worker failed
+	or timed out every time it ran it. error is the last failure.
+	'''
+	def __init__(self, arg, error):
+		Exception.__init__(self, 'task failed: %r' % error)
+		self.arg = arg
+		self.error = error
+
+class Pool(object):
+	'''
+	Keeps execnet gateways running a remote module, so many calls to map can
+	reuse them instead of starting new processes every time. Like the
+	module level map, the remote module receives (i, arg) and sends back
+	(i, result). Dead workers are restarted before each map.
+	
+	>>> import remote_double
+	>>> with Pool(remote_double) as pool:
+	...     pool.map(range(5)), pool.map([10])
+	([0, 2, 4, 6, 8], [20])
+	>>> map(remote_double, range(7), chunksize=2)
+	[0, 2, 4, 6, 8, 10, 12]
+	>>> with Pool(remote_double) as pool:
+	...     results = pool.imap(itertools.count(), max_pending=3)
+	...     list(itertools.islice(results, 4)), sorted(pool.imap_unordered(range(4)))
+	([0, 2, 4, 6], [0, 2, 4, 6])
+	
+	With batched, the remote module instead receives lists of (i, arg),
+	and sends back a list of (i, result) for each, so chunksize args share
+	one message each way, like remote_double_batch.
+	
+	>>> import remote_double_batch
+	>>> with Pool(remote_double_batch, batched=True) as pool:
+	...     pool.map(range(7), chunksize=3)
+	[0, 2, 4, 6, 8, 10, 12]
+	
+	A worker that raises or dies is restarted, and the args it was running
+	are sent again. An arg that still fails is a TaskError.
+	
+	>>> with Pool(remote_double) as pool:
+	...     results = pool.map([1, None, 3], retries=1, return_errors=True)
+	>>> results[0], results[1].arg, results[2]
+	(2, None, 6)
+	'''
+	def __init__(self, mod, specs=[('popen', 2)], batched=False):
+		self.mod = mod
+		self.batched = batched
+		# each worker has its own group, so a hung one can be killed alone
+		self._groups = {}
+		self._queue = queue.Queue()
+		# task ids keep increasing across maps, so results left over from an
+		# earlier map can be told apart
+		self._ids = itertools.count()
+		self._specs = [spec for (spec, count) in specs for i in range(count)]
+		self._channels = [self._start(spec) for spec in self._specs]
 	
-	for spec, count in specs:
-		for i in range(count):
-			gw = execnet.makegateway(spec)
-			gateways.append(gw)
-			channels.append(gw.remote_exec(mod))
+	def __enter__(self):
+		return self
 	
-	cyc = itertools.cycle(channels)
+	def __exit__(self, *exc_info):
+		self.close()
 	
-	for i, arg in enumerate(args):
-		channel = next(cyc)
-		channel.send((i, arg))
+	def _start(self, spec):
+		group = execnet.Group()
+		channel = group.makegateway(spec).remote_exec(self.mod)
+		self._groups[channel] = group
+		# a channel with a callback can't be read with receive, so every
+		# message goes into one queue, along with which channel sent it
+		channel.setcallback(lambda msg: self._queue.put((channel, msg)), endmarker=_closed)
+		return channel
 	
-	mch = execnet.MultiChannel(channels)
-	queue = mch.make_receive_queue()
-	l = len(args)
-	results = [None] * l
+	def _alive(self, channel):
+		return not channel.isclosed() and channel.gateway.hasreceiver()
 	
-	for j in range(l):
-		channel, (i, result) = queue.get()
-		results[i] = result
+	def _restart(self, channel):
+		k = self._channels.index(channel)
+		# kills the worker if it doesn't exit within a second
+		self._groups.pop(channel).terminate(timeout=1)
+		self._channels[k] = self._start(self._specs[k])
+		return self._channels[k]
 	
-	for gw in gateways:
-		gw.exit()
+	def _error(self, channel):
+		# the remote error a closed channel ended with, if any
+		try:
+			channel.waitclose(0)
+		except Exception as exc:
+			return exc
 	
-	return results
\ No newline at end of file
+	def check(self):
+		'''
+		Restarts every worker whose channel or gateway has closed, and
+		returns how many were restarted.
+		'''
+		dead = [channel for channel in self._channels if not self._alive(channel)]
+		
+		for channel in dead:
+			self._restart(channel)
+		
+		return len(dead)
+	
+	def _results(self, args, chunksize, max_pending, ordered, timeout, retries, return_errors):
+		self.check()
+		tasks = ((next(self._ids), arg) for arg in args)
+		# args not yet yielded by id, and the ids in the order they were
+		# sent, with the channel running each, or None while waiting to be
+		# sent again
+		sent = {}
+		waiting = collections.OrderedDict()
+		in_flight = dict([(channel, 0) for channel in self._channels])
+		# when each busy worker last sent a result, or was given work
+		active = {}
+		failures = collections.Counter()
+		resend = collections.deque()
+		alone = set()
+		results = {}
+		
+		def send(channel, ids):
+			for i in ids:
+				waiting[i] = channel
+			
+			active.setdefault(channel, time.time())
+			in_flight[channel] += len(ids)
+			
+			try:
+				if self.batched:
+					channel.send([(i, sent[i]) for i in ids])
+				else:
+					for i in ids:
+						channel.send((i, sent[i]))
+			except OSError:
+				# the worker just died, its args are sent again once the
+				# queue gets its channel's endmarker
+				pass
+		
+		def fail(channel, error):
+			# restarts the worker, and sends its args again unless they have
+			# failed more than retries times, returning errors for those
+			new = self._restart(channel)
+			in_flight[new] = 0
+			active.pop(channel, None)
+			errors = []
+			
+			for i in [i for (i, c) in waiting.items() if c is channel]:
+				waiting[i] = None
+				
+				# only an arg that ran alone is sure to be the one to blame
+				if channel in alone:
+					failures[i] += 1
+				
+				if failures[i] > retries:
+					errors.append((i, TaskError(sent[i], error)))
+				else:
+					resend.append(i)
+			
+			alone.discard(channel)
+			return errors
+		
+		while True:
+			for channel in self._channels:
+				if channel in alone:
+					continue
+				elif resend:
+					# an arg sent again runs alone, once the worker is idle
+					if not in_flight[channel]:
+						send(channel, [resend.popleft()])
+						alone.add(channel)
+				elif in_flight[channel] <= chunksize:
+					# a worker starts with two chunks, and gets another
+					# whenever it finishes one, while fewer than
+					# max_pending are waiting
+					n = 2 * chunksize - in_flight[channel]
+					
+					if max_pending is not None:
+						n = min(n, max_pending - len(waiting))
+					
+					ids = []
+					
+					for (i, arg) in itertools.islice(tasks, max(n, 0)):
+						sent[i] = arg
+						ids.append(i)
+					
+					for start in range(0, len(ids), chunksize):
+						send(channel, ids[start:start + chunksize])
+			
+			if not waiting:
+				break
+			
+			done = []
+			
+			try:
+				wait = None
+				
+				if timeout is not None and active:
+					wait = max(min(active.values()) + timeout - time.time(), 0)
+				
+				channel, msg = self._queue.get(timeout=wait)
+				
+				if msg is _closed:
+					if channel in self._channels:
+						done = fail(channel, self._error(channel))
+				else:
+					replies = msg if self.batched else [msg]
+					done = [(i, result) for (i, result) in replies if waiting.get(i) is channel]
+					
+					for (i, result) in done:
+						waiting[i] = None
+					
+					if done:
+						in_flight[channel] -= len(done)
+						alone.discard(channel)
+						
+						if in_flight[channel]:
+							active[channel] = time.time()
+						else:
+							del active[channel]
+			except queue.Empty:
+				for channel in [c for (c, t) in active.items() if time.time() - t >= timeout]:
+					done.extend(fail(channel, TimeoutError('no result in %s seconds' % timeout)))
+			
+			for (i, result) in done:
+				if isinstance(result, TaskError) and not return_errors:
+					raise result
+				
+				del sent[i]
+				
+				if not ordered:
+					del waiting[i]
+					yield result
+					continue
+				
+				results[i] = result
+				
+				while waiting and next(iter(waiting)) in results:
+					i = next(iter(waiting))
+					del waiting[i]
+					yield results.pop(i)
+	
+	def imap(self, args, chunksize=1, max_pending=None, timeout=None, retries=2, return_errors=False):
+		'''
+		Yields the results of any iterable of args in order, as soon as they
+		and every result before them arrive. Workers pull chunksize args at
+		a time: each starts with two chunks, and gets another whenever it
+		finishes one, so a slow arg only holds up its own worker. Unless the
+		pool is batched, a chunk is still sent as one message per arg, so
+		chunksize only changes how much work a worker has queued. At most
+		max_pending args are sent but not yet yielded, by default four
+		chunks per worker, so memory stays bounded however many args there
+		are. Only one map should be running on a pool at a time.
+		
+		A worker fails when its channel closes, or when it's busy but sends
+		no result for timeout seconds. It is restarted, and its args are
+		sent again, one at a time, to find the one to blame. An arg that
+		fails more than retries times raises a TaskError, or with
+		return_errors, the TaskError is its result.
+		'''
+		if max_pending is None:
+			max_pending = 4 * chunksize * len(self._channels)
+		
+		return self._results(args, chunksize, max_pending, True, timeout, retries, return_errors)
+	
+	def imap_unordered(self, args, chunksize=1, max_pending=None, timeout=None, retries=2, return_errors=False):
+		'''
+		Like imap, but yields each result as soon as it arrives.
+		'''
+		if max_pending is None:
+			max_pending = 4 * chunksize * len(self._channels)
+		
+		return self._results(args, chunksize, max_pending, False, timeout, retries, return_errors)
+	
+	def map(self, args, chunksize=1, timeout=None, retries=2, return_errors=False):
+		'''
+		Returns the list of results of args in order, scheduled like imap,
+		but without a max_pending limit, since every result is kept anyway.
+		'''
+		return list(self._results(args, chunksize, None, True, timeout, retries, return_errors))
+	
+	def close(self):
+		for group in self._groups.values():
+			group.terminate(timeout=5)
+		
+		self._groups.clear()
+
+def map(mod, args, specs=[('popen', 2)], batched=False, **kwargs):
+	with Pool(mod, specs=specs, batched=batched) as pool:
+		return pool.map(args, **kwargs)
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
\ No newline at end of file
@@ -1,17 +1,58 @@
-import collections, re
+import collections, re, time
+from collections.abc import Mapping, MutableMapping
 
 white = re.compile('[\s&]+')
 
 def encode_key(key):
 	return white.sub('_', key.strip())
 
-class RedisHashMap(collections.MutableMapping):
+def _score_bound(bound):
+	# a score range bound like redis takes, a number, '-inf', '+inf', or
+	# prefixed with ( to exclude it, as (score, excluded)
+	if isinstance(bound, bytes):
+		bound = bound.decode()
+	
+	if isinstance(bound, str) and bound.startswith('('):
+		return float(bound[1:]), True
+	else:
+		return float(bound), False
+
+def unlink_keys(r, names, batch_size=1000, unlink=True):
+	'''
+	Removes keys with pipelined UNLINK commands of batch_size keys each,
+	so the server frees their memory in the background instead of blocking.
+	UNLINK needs redis 4.0, so for older servers pass unlink=False to use
+	DEL. Returns the number of keys removed.
+	'''
+	names = list(names)
+	pipe = r.pipeline(transaction=False)
+	
+	for i in range(0, len(names), batch_size):
+		if unlink:
+			pipe.execute_command('UNLINK', *names[i:i + batch_size])
+		else:
+			pipe.delete(*names[i:i + batch_size])
+	
+	return sum(pipe.execute())
+
+def expire_keys(r, names, ttl):
+	'''
+	Sets every key to expire in ttl seconds, in one pipeline.
+	'''
+	pipe = r.pipeline(transaction=False)
+	
+	for name in names:
+		pipe.expire(name, ttl)
+	
+	pipe.execute()
+
+class RedisHashMap(MutableMapping):
 	def __init__(self, r, name):
 		self._r = r
 		self._name = encode_key(name)
 	
 	def __iter__(self):
-		return self.items()
+		return self.iterkeys()
 	
 	def __len__(self):
 		return self._r.hlen(self._name)
@@ -37,13 +78,44 @@ class RedisHashMap(collections.MutableMapping):
 	def items(self):
 		return self._r.hgetall(self._name).items()
 	
+	def iteritems(self, page_size=1000):
+		'''
+		Yields (key, value) pairs using HSCAN, about page_size at a time, so
+		a large hash is never held in memory at once. Keys changed during
+		iteration may be missed or repeated.
+		'''
+		return self._r.hscan_iter(self._name, count=page_size)
+	
+	def iterkeys(self, page_size=1000):
+		for key, val in self.iteritems(page_size=page_size):
+			yield key
+	
 	def get(self, key, default=0):
 		return self[key] or default
 	
+	def get_many(self, keys, batch_size=1000):
+		'''
+		Returns a list of the values of keys, None for missing keys, with
+		one HMGET per batch_size keys.
+		'''
+		keys = [encode_key(key) for key in keys]
+		vals = []
+		
+		for i in range(0, len(keys), batch_size):
+			vals.extend(self._r.hmget(self._name, keys[i:i + batch_size]))
+		
+		return vals
+	
+	def redis_keys(self):
+		'''
+		Returns the names of the redis keys holding this collection.
+		'''
+		return [self._name]
+	
 	def clear(self):
 		self._r.delete(self._name)
 
-class RedisOrderedDict(collections.MutableMapping):
+class RedisOrderedDict(MutableMapping):
 	'''
 	>>> from redis import Redis
 	>>> r = Redis()
@@ -59,6 +131,18 @@ class RedisOrderedDict(collections.MutableMapping):
 	1
 	>>> rod.items()
 	[(b'bar', 5.2)]
+	>>> rod['foo'] = 10
+	>>> list(rod.iteritems(page_size=1))
+	[(b'foo', 10.0), (b'bar', 5.2)]
+	>>> rod.update({'baz': 1, 'qux': 2}, batch_size=1)
+	>>> rod.get_many(['bar', 'baz', 'missing'])
+	[5.2, 1.0, None]
+	>>> list(rod.range_by_score(min=2, page_size=1))
+	[(b'foo', 10.0), (b'bar', 5.2), (b'qux', 2.0)]
+	>>> list(rod.range_by_score(min=2, max='(10', limit=1))
+	[(b'bar', 5.2)]
+	>>> list(rod.top_k(2, page_size=1))
+	[(b'foo', 10.0), (b'bar', 5.2)]
 	>>> rod.clear()
 	'''
 	def __init__(self, r, name):
@@ -66,7 +150,7 @@ class RedisOrderedDict(collections.MutableMapping):
 		self._name = encode_key(name)
 	
 	def __iter__(self):
-		return iter(self.items())
+		return self.iteritems()
 	
 	def __len__(self):
 		return self._r.zcard(self._name)
@@ -93,12 +177,244 @@ class RedisOrderedDict(collections.MutableMapping):
 	def get(self, key, default=0):
 		return self[key] or default
 	
-	def iteritems(self):
-		return iter(self)
+	def get_many(self, keys, batch_size=1000):
+		'''
+		Returns a list of the scores of keys, None for missing keys, using
+		pipelined ZSCORE commands, one round-trip per batch_size keys.
+		'''
+		scores = []
+		pipe = self._r.pipeline(transaction=False)
+		
+		for i, key in enumerate(keys, 1):
+			pipe.zscore(self._name, encode_key(key))
+			
+			if i % batch_size == 0:
+				scores.extend(pipe.execute())
+		
+		scores.extend(pipe.execute())
+		return scores
+	
+	def update(self, mapping, batch_size=1000):
+		'''
+		Sets the scores from a mapping or iterable of (key, score) pairs
+		with pipelined ZADD commands, one round-trip per batch_size keys.
+		'''
+		if isinstance(mapping, Mapping):
+			mapping = mapping.items()
+		
+		pipe = self._r.pipeline(transaction=False)
+		
+		for i, (key, score) in enumerate(mapping, 1):
+			pipe.zadd(self._name, encode_key(key), score)
+			
+			if i % batch_size == 0:
+				pipe.execute()
+		
+		pipe.execute()
+	
+	def iteritems(self, page_size=1000):
+		'''
+		Yields (key, score) pairs from highest to lowest score, fetching
+		page_size at a time with ZREVRANGE. Keys added or removed during
+		iteration may shift items across pages.
+		'''
+		start = 0
+		
+		while True:
+			page = self._r.zrevrange(self._name, start, start + page_size - 1, withscores=True)
+			
+			for item in page:
+				yield item
+			
+			if len(page) < page_size:
+				break
+			
+			start += page_size
+	
+	def range_by_score(self, min='-inf', max='+inf', limit=None, page_size=1000):
+		'''
+		Yields at most limit (key, score) pairs with min <= score <= max,
+		from highest to lowest score. Like redis, prefix a bound with ( to
+		exclude it. The keys scored above max are counted once with ZCOUNT,
+		then pages of page_size are fetched by rank with ZREVRANGE, so no
+		page has to skip over the ones before it.
+		'''
+		low, low_excluded = _score_bound(min)
+		high, high_excluded = _score_bound(max)
+		
+		if high == float('inf') and not high_excluded:
+			start = 0
+		elif high_excluded:
+			start = self._r.zcount(self._name, high, '+inf')
+		else:
+			start = self._r.zcount(self._name, '(%r' % high, '+inf')
+		
+		found = 0
+		
+		while limit is None or found < limit:
+			num = page_size
+			
+			if limit is not None and limit - found < page_size:
+				num = limit - found
+			
+			page = self._r.zrevrange(self._name, start, start + num - 1, withscores=True)
+			
+			for key, score in page:
+				if score < low or (low_excluded and score == low):
+					return
+				
+				yield key, score
+			
+			if len(page) < num:
+				break
+			
+			found += num
+			start += num
+	
+	def top_k(self, k, page_size=1000):
+		'''
+		Yields the k (key, score) pairs with the highest scores.
+		'''
+		return self.range_by_score(limit=k, page_size=page_size)
+	
+	def redis_keys(self):
+		return [self._name]
 	
 	def clear(self):
 		self._r.delete(self._name)
 
+class RedisCache(MutableMapping):
+	'''
+	A local read-through LRU cache in front of a RedisHashMap,
+	RedisHashFreqDist or RedisOrderedDict, for read-mostly data. At most
+	maxsize values are cached, each for ttl seconds, or until invalidated if
+	ttl is None. Writes go to Redis and invalidate the cached value.
+	snapshot() copies the whole collection locally, and reads are then
+	served only from that copy until invalidate() is called. Keys are
+	cached encoded, as Redis stores them, so 'a b' and 'a_b' share a value,
+	and iterating yields the encoded keys, with or without a snapshot.
+	
+	>>> from redis import Redis
+	>>> rod = RedisOrderedDict(Redis(), 'test')
+	>>> rod['bar'] = 5.2
+	>>> cache = RedisCache(rod, maxsize=10)
+	>>> cache['bar'], cache['bar']
+	(5.2, 5.2)
+	>>> cache.hits, cache.misses, cache.hit_rate()
+	(1, 1, 0.5)
+	>>> cache['bar'] = 2
+	>>> cache['bar']
+	2.0
+	>>> cache[' bar '], cache.hits
+	(2.0, 2)
+	>>> list(cache)
+	[b'bar']
+	>>> cache.snapshot()
+	>>> list(cache)
+	[b'bar']
+	>>> rod['foo'] = 1
+	>>> cache['foo'] is None
+	True
+	>>> cache.invalidate()
+	>>> cache['foo']
+	1.0
+	>>> rod.clear()
+	'''
+	def __init__(self, collection, maxsize=10000, ttl=None):
+		self._collection = collection
+		self.maxsize = maxsize
+		self.ttl = ttl
+		self._cache = collections.OrderedDict()
+		self._snapshot = None
+		self.hits = 0
+		self.misses = 0
+	
+	def _missing(self, key):
+		# what the collection returns for a key it doesn't have
+		missing = getattr(self._collection, '__missing__', None)
+		return missing(key) if missing else None
+	
+	def __getitem__(self, key):
+		# cached by the key redis has, so keys that encode the same share
+		# one cached value
+		ckey = encode_key(key)
+		
+		if self._snapshot is not None:
+			self.hits += 1
+			skey = ckey.encode()
+			return self._snapshot[skey] if skey in self._snapshot else self._missing(key)
+		
+		if ckey in self._cache:
+			val, expires = self._cache[ckey]
+			
+			if expires is None or expires > time.time():
+				self._cache.move_to_end(ckey)
+				self.hits += 1
+				return val
+		
+		self.misses += 1
+		val = self._collection[key]
+		expires = time.time() + self.ttl if self.ttl is not None else None
+		self._cache[ckey] = (val, expires)
+		self._cache.move_to_end(ckey)
+		
+		if len(self._cache) > self.maxsize:
+			self._cache.popitem(last=False)
+		
+		return val
+	
+	def __setitem__(self, key, val):
+		self._collection[key] = val
+		self._refresh(key)
+	
+	def __delitem__(self, key):
+		del self._collection[key]
+		self._refresh(key)
+	
+	def _refresh(self, key):
+		self._cache.pop(encode_key(key), None)
+		
+		if self._snapshot is not None:
+			skey = encode_key(key).encode()
+			self._snapshot.pop(skey, None)
+			
+			val = self._collection[key]
+			
+			if val != self._missing(key):
+				self._snapshot[skey] = val
+	
+	def __iter__(self):
+		if self._snapshot is not None:
+			return iter(list(self._snapshot.keys()))
+		
+		# a RedisOrderedDict iterates (key, score), so take the keys of
+		# iteritems to yield the same as a snapshot does
+		return (key for (key, val) in self._collection.iteritems())
+	
+	def __len__(self):
+		if self._snapshot is not None:
+			return len(self._snapshot)
+		
+		return len(self._collection)
+	
+	def snapshot(self, page_size=1000):
+		self._snapshot = dict(self._collection.iteritems(page_size=page_size))
+	
+	def invalidate(self, key=None):
+		'''
+		Forgets the cached value of key, or every cached value and any
+		snapshot if key is None.
+		'''
+		if key is None:
+			self._cache.clear()
+			self._snapshot = None
+		else:
+			self._cache.pop(encode_key(key), None)
+	
+	def hit_rate(self):
+		lookups = self.hits + self.misses
+		return float(self.hits) / lookups if lookups else None
+
 if __name__ == '__main__':
 	import doctest
 	doctest.testmod()
\ No newline at end of file
@@ -1,5 +1,23 @@
+import collections
+from collections.abc import Mapping
 from nltk.probability import ConditionalFreqDist
-from rediscollections import RedisHashMap, encode_key
+from rediscollections import RedisHashMap, encode_key, unlink_keys
+
+# KEYS = hash, totals; ARGV = key, new count, or nothing to delete the key
+SET_COUNT_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or 0)
+local new = 0
+
+if ARGV[2] then
+	new = tonumber(ARGV[2])
+	redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+else
+	redis.call('HDEL', KEYS[1], ARGV[1])
+end
+
+redis.call('HINCRBY', KEYS[2], KEYS[1], new - old)
+return old
+"""
 
 class RedisHashFreqDist(RedisHashMap):
 	'''
@@ -23,10 +41,40 @@ class RedisHashFreqDist(RedisHashMap):
 	[1]
 	>>> len(rhfd)
 	1
+	>>> rhfd.update(['foo', 'bar', 'foo'])
+	>>> rhfd['foo'], rhfd['bar']
+	(3, 1)
+	>>> rhfd.increment('bar', 2)
+	3
+	>>> rhfd.get_many(['foo', 'bar', 'baz'])
+	[3, 3, 0]
+	>>> sorted(rhfd.iteritems(page_size=1))
+	[(b'bar', 3), (b'foo', 3)]
+	>>> rhfd.N()
+	6
+	>>> rhfd['foo'] = 1
+	>>> rhfd.N()
+	4
+	>>> rhfd.redis_keys()
+	['test', 'test.N']
 	>>> rhfd.clear()
+	>>> rhfd.N()
+	0
 	'''
+	def __init__(self, r, name, totals=None):
+		RedisHashMap.__init__(self, r, name)
+		# the running total of all counts is kept in the field named after
+		# this hash in the totals hash, so N() doesn't have to sum the values
+		self._totals = encode_key(totals or '%s.N' % name)
+		self._shared_totals = totals is not None
+	
 	def N(self):
-		return int(sum(self.values()))
+		total = self._r.hget(self._totals, self._name)
+		
+		if total is None: # counted before totals were kept
+			return int(sum(self.values()))
+		
+		return int(total)
 	
 	def __missing__(self, key):
 		return 0
@@ -34,11 +82,110 @@ class RedisHashFreqDist(RedisHashMap):
 	def __getitem__(self, key):
 		return int(RedisHashMap.__getitem__(self, key) or 0)
 	
+	def _set_count(self, key, val=None):
+		# the old count must be read in the same transaction as the new one
+		# is written, or concurrent writers make the total drift. That's
+		# one SET_COUNT_SCRIPT call, or a WATCH transaction for clients
+		# without scripting, like localredis.LocalRedis
+		key = encode_key(key)
+		
+		if hasattr(self._r, 'register_script'):
+			args = [key] if val is None else [key, int(val)]
+			self._r.register_script(SET_COUNT_SCRIPT)(keys=[self._name, self._totals], args=args)
+			return
+		
+		def set_count(pipe):
+			old = int(pipe.hget(self._name, key) or 0)
+			pipe.multi()
+			
+			if val is None:
+				pipe.hdel(self._name, key)
+				pipe.hincrby(self._totals, self._name, -old)
+			else:
+				pipe.hset(self._name, key, int(val))
+				pipe.hincrby(self._totals, self._name, int(val) - old)
+		
+		self._r.transaction(set_count, self._name)
+	
+	def __setitem__(self, key, val):
+		self._set_count(key, val)
+	
+	def __delitem__(self, key):
+		self._set_count(key)
+	
 	def values(self):
 		return [int(v) for v in RedisHashMap.values(self)]
 	
 	def items(self):
 		return [(k, int(v)) for (k, v) in RedisHashMap.items(self)]
+	
+	def iteritems(self, page_size=1000):
+		for (k, v) in RedisHashMap.iteritems(self, page_size=page_size):
+			yield k, int(v)
+	
+	def get_many(self, keys, batch_size=1000):
+		return [int(v or 0) for v in RedisHashMap.get_many(self, keys, batch_size=batch_size)]
+	
+	def increment(self, key, count=1):
+		'''
+		Atomically adds count to key with HINCRBY, and returns the new count.
+		'''
+		pipe = self._r.pipeline(transaction=True)
+		pipe.hincrby(self._name, encode_key(key), count)
+		pipe.hincrby(self._totals, self._name, count)
+		return pipe.execute()[0]
+	
+	def increment_many(self, counts, batch_size=1000, pipe=None):
+		'''
+		Adds a mapping of key to count with pipelined HINCRBY commands,
+		one round-trip per batch_size keys. If pipe is given, the commands
+		are only queued on it, for the caller to execute.
+		'''
+		if pipe is not None:
+			for key, count in counts.items():
+				pipe.hincrby(self._name, encode_key(key), count)
+			
+			pipe.hincrby(self._totals, self._name, sum(counts.values()))
+			return
+		
+		pipe = self._r.pipeline(transaction=False)
+		total = 0
+		
+		for i, (key, count) in enumerate(counts.items(), 1):
+			pipe.hincrby(self._name, encode_key(key), count)
+			total += count
+			
+			if i % batch_size == 0:
+				pipe.hincrby(self._totals, self._name, total)
+				pipe.execute()
+				total = 0
+		
+		pipe.hincrby(self._totals, self._name, total)
+		pipe.execute()
+	
+	def update(self, samples, batch_size=1000):
+		'''
+		Counts an iterable of samples, or adds a mapping of sample to count,
+		like FreqDist.update. Samples are counted locally first, so each
+		distinct sample is a single HINCRBY.
+		'''
+		if not isinstance(samples, Mapping):
+			samples = collections.Counter(samples)
+		
+		self.increment_many(samples, batch_size=batch_size)
+	
+	def redis_keys(self):
+		# a shared totals hash belongs to the conditional freq dist
+		if self._shared_totals:
+			return [self._name]
+		else:
+			return [self._name, self._totals]
+	
+	def clear(self):
+		pipe = self._r.pipeline(transaction=True)
+		pipe.delete(self._name)
+		pipe.hdel(self._totals, self._name)
+		pipe.execute()
 
 class RedisConditionalHashFreqDist(ConditionalFreqDist):
 	'''
@@ -56,28 +203,65 @@ class RedisConditionalHashFreqDist(ConditionalFreqDist):
 	1
 	>>> rchfd.conditions()
 	['cond1']
+	>>> RedisConditionalHashFreqDist(r, 'condhash').conditions()
+	['cond1']
+	>>> rchfd['cond2'].update(['bar'])
+	>>> sorted(rchfd.redis_keys())
+	['condhash.N', 'condhash:cond1', 'condhash:cond2']
 	>>> rchfd.clear()
+	>>> RedisConditionalHashFreqDist(r, 'condhash').conditions()
+	[]
+	>>> rchfd.conditions()
+	[]
 	'''
 	def __init__(self, r, name, cond_samples=None):
 		self._r = r
 		self._name = name
+		# running totals of every condition, see RedisHashFreqDist. Its
+		# fields are also the known conditions, so they can be found
+		# without scanning the keyspace
+		self._totals = encode_key('%s.N' % name)
 		ConditionalFreqDist.__init__(self, cond_samples)
+	
+	def _discover(self):
+		prefix = encode_key('%s:' % self._name).encode()
 		
-		for key in self._r.keys(encode_key('%s:*' % name)):
-			condition = key.split(b':')[1].decode()
+		for key in self._r.hkeys(self._totals):
+			condition = key[len(prefix):].decode()
 			self[condition] # calls self.__getitem__(condition)
 	
+	def conditions(self):
+		self._discover()
+		return ConditionalFreqDist.conditions(self)
+	
 	def __getitem__(self, condition):
 		if condition not in self:
 			key = '%s:%s' % (self._name, condition)
-			val = RedisHashFreqDist(self._r, key)
+			val = RedisHashFreqDist(self._r, key, totals=self._totals)
 			super(RedisConditionalHashFreqDist, self).__setitem__(condition, val)
 		
 		return super(RedisConditionalHashFreqDist, self).__getitem__(condition)
 	
+	def N(self):
+		return sum([int(total) for total in self._r.hvals(self._totals)])
+	
+	def redis_keys(self):
+		self._discover()
+		return [self._totals] + [fdist._name for fdist in self.values()]
+	
 	def clear(self):
-		for fdist in self.values():
-			fdist.clear()
+		self._r.delete(*self.redis_keys())
+		ConditionalFreqDist.clear(self)
+	
+	def unlink(self, batch_size=1000, unlink=True):
+		'''
+		Removes every condition and the totals like clear, but with
+		rediscollections.unlink_keys, so the server frees them in the
+		background.
+		'''
+		removed = unlink_keys(self._r, self.redis_keys(), batch_size=batch_size, unlink=unlink)
+		ConditionalFreqDist.clear(self)
+		return removed
 
 if __name__ == '__main__':
 	import doctest
@@ -0,0 +1,4 @@
+
+if __name__ == '__channelexec__':
+	for batch in channel:
+		channel.send([(i, arg * 2) for (i, arg) in batch])
\ No newline at end of file
@@ -1,19 +1,47 @@
-from redis import Redis
+import collections
+from localredis import connect
 from redisprob import RedisHashFreqDist, RedisConditionalHashFreqDist
 
+def flush(r, fd, cfd, label_word_counts, ttl=None):
+	# one transaction, so other workers never see partial counts, and keys
+	# never exist without their expiration
+	pipe = r.pipeline(transaction=True)
+	names = fd.redis_keys() + [cfd._totals]
+	
+	for label, word_counts in label_word_counts.items():
+		fd.increment_many(word_counts, pipe=pipe)
+		cfd[label].increment_many(word_counts, pipe=pipe)
+		names.extend(cfd[label].redis_keys())
+	
+	if ttl:
+		for name in names:
+			pipe.expire(name, ttl)
+	
+	pipe.execute()
+	label_word_counts.clear()
+
 if __name__ == '__channelexec__':
-	host, fd_name, cfd_name = channel.receive()
-	r = Redis(host)
+	setup = channel.receive()
+	host, fd_name, cfd_name = setup[:3]
+	flush_size = setup[3] if len(setup) > 3 else 10000
+	ttl = setup[4] if len(setup) > 4 else None
+	r = connect(host)
 	fd = RedisHashFreqDist(r, fd_name)
 	cfd = RedisConditionalHashFreqDist(r, cfd_name)
+	label_word_counts = collections.defaultdict(collections.Counter)
+	# ask for work, then ask for the next chunk as soon as one arrives, so
+	# the driver can send it while this one is counted
+	channel.send('ready')
 	
 	for data in channel:
 		if data == 'done':
+			flush(r, fd, cfd, label_word_counts, ttl=ttl)
 			channel.send('done')
 			break
 		
+		channel.send('ready')
 		label, words = data
+		label_word_counts[label].update(words)
 		
-		for word in words:
-			fd[word] += 1
-			cfd[label][word] += 1
\ No newline at end of file
+		if sum([len(word_counts) for word_counts in label_word_counts.values()]) >= flush_size:
+			flush(r, fd, cfd, label_word_counts, ttl=ttl)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import collections, math, random, numpy
+from collections.abc import Mapping
+
+# Mersenne prime used for the pairwise independent row hashes
+_PRIME = (1 << 61) - 1
+
+class CountMinSketch(object):
+	'''
+	Approximate sample counts in fixed memory. An estimate is never below the
+	true count, and with probability 1 - delta it is at most epsilon * N above.
+	Uses e / epsilon * ln(1 / delta) counters regardless of the number of
+	distinct samples. Hashing uses hash(), so sketches from different
+	processes should not be compared.
+	
+	>>> cms = CountMinSketch(epsilon=0.01, delta=0.01)
+	>>> cms.width, cms.depth
+	(272, 5)
+	>>> cms.update(['foo', 'foo', 'bar'])
+	>>> cms['foo']
+	2
+	>>> cms.N()
+	3
+	'''
+	def __init__(self, epsilon=0.001, delta=0.01, seed=None):
+		self.width = int(math.ceil(math.e / epsilon))
+		self.depth = int(math.ceil(math.log(1.0 / delta)))
+		rand = random.Random(seed)
+		self._hashes = [(rand.randint(1, _PRIME - 1), rand.randint(0, _PRIME - 1)) for i in range(self.depth)]
+		self._rows = numpy.arange(self.depth)
+		self._counts = numpy.zeros((self.depth, self.width), dtype=numpy.int64)
+		self._n = 0
+	
+	def _cols(self, sample):
+		h = hash(sample)
+		return [((a * h + b) % _PRIME) % self.width for (a, b) in self._hashes]
+	
+	def add(self, sample, count=1):
+		self._counts[self._rows, self._cols(sample)] += count
+		self._n += count
+	
+	def update(self, samples):
+		'''
+		Adds an iterable of samples, or a mapping of sample to count.
+		'''
+		if not isinstance(samples, Mapping):
+			samples = collections.Counter(samples)
+		
+		for sample, count in samples.items():
+			self.add(sample, count)
+	
+	def __getitem__(self, sample):
+		return int(self._counts[self._rows, self._cols(sample)].min())
+	
+	def N(self):
+		return self._n
+
+class HeavyHitters(object):
+	'''
+	Misra-Gries summary that keeps at most 2k counters. When it's full, every
+	counter is reduced by the same amount, and error() is the sum of those
+	reductions, which is at most N / (k + 1). A kept count is never above the
+	true count and at most error() below it, and a sample that isn't kept
+	occurs at most error() times, so every sample occurring more than
+	error() times is kept. Kept counts of at most error() may be any sample
+	added since the last reduction, not a heavy hitter.
+	
+	>>> hh = HeavyHitters(k=1)
+	>>> hh.update(['foo', 'foo', 'foo', 'bar', 'bar', 'baz'])
+	>>> hh.N(), hh.error()
+	(6, 2)
+	>>> hh.items()
+	[('foo', 1)]
+	>>> hh.bounds('foo'), hh.bounds('bar')
+	((1, 3), (0, 2))
+	'''
+	def __init__(self, k=1000):
+		self.k = k
+		self._counts = {}
+		self._n = 0
+		self._error = 0
+	
+	def add(self, sample, count=1):
+		self._counts[sample] = self._counts.get(sample, 0) + count
+		self._n += count
+		
+		# let the summary grow to 2k counters, then subtract the (k+1)th
+		# largest count from all of them, which drops at least k+1 counters
+		if len(self._counts) > 2 * self.k:
+			self._reduce()
+	
+	def _reduce(self):
+		counts = numpy.fromiter(self._counts.values(), dtype=numpy.int64, count=len(self._counts))
+		threshold = int(numpy.partition(counts, -(self.k + 1))[-(self.k + 1)])
+		self._error += threshold
+		self._counts = dict([(sample, count - threshold) for (sample, count) in self._counts.items() if count > threshold])
+	
+	def update(self, samples):
+		'''
+		Adds an iterable of samples, or a mapping of sample to count.
+		'''
+		if not isinstance(samples, Mapping):
+			samples = collections.Counter(samples)
+		
+		for sample, count in samples.items():
+			self.add(sample, count)
+	
+	def __getitem__(self, sample):
+		return self._counts.get(sample, 0)
+	
+	def bounds(self, sample):
+		'''
+		Returns the lowest and highest the true count of sample can be.
+		'''
+		count = self[sample]
+		return count, count + self._error
+	
+	def items(self):
+		return list(self._counts.items())
+	
+	def error(self):
+		return self._error
+	
+	def N(self):
+		return self._n
+
+if __name__ == '__main__':
+	import doctest
+	doctest.testmod()
\ No newline at end of file